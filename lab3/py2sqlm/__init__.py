@@ -1,8 +1,24 @@
+import os
+import time
 import logging
 import psycopg2
-import json
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+import weakref
+from itertools import count as counter
+from datetime import datetime
 from functools import wraps
 from py2sqlm.fields import *
+from py2sqlm.cache import ObjectCache
+from py2sqlm.notify import InvalidationListener, build_payloads, check_channel_name
+from py2sqlm.indexes import MANAGED_INDEX_COMMENT, get_class_indexes
+from py2sqlm.partitions import RangePartitioning, get_key_columns
+from py2sqlm.replicas import ReplicaPool
+from py2sqlm.table import SCHEMA_COMMENT_PREFIX
+from py2sqlm.pages import decode_cursor, encode_cursor
+from py2sqlm.query import Condition, compile_condition, compile_select, get_shape, to_prepared_query
+from py2sqlm.stats import TABLE_STATS_QUERY, TableStats
+from py2sqlm.loader import CsvRowsReader, chunks, get_object_row, init_worker, is_path, load_shard, read_csv_shards, \
+    to_sql_row
 
 
 def transactional(f):
@@ -10,6 +26,9 @@ def transactional(f):
     Decorator for transactional methods.
     Wrapped method is executed in transaction and
     is rollbacked in case of a failure.
+    Statements which can not run in transaction are executed after commit.
+    Queued statements are sent before commit.
+    Reads are routed to primary during transaction and for sticky_seconds after it.
 
     :param f: transactional method
     :return: transactional wrapper
@@ -17,12 +36,24 @@ def transactional(f):
 
     @wraps(f)
     def wrapper(self, *args, **kwargs):
+        self._in_transaction = True
         try:
-            f(self, *args, **kwargs)
+            result = f(self, *args, **kwargs)
+            self._flush_notifications()
+            self._flush_pipeline()
         except Exception as exc:
             self.connection.rollback()
+            self._pending_notifications.clear()
+            self._deferred_statements.clear()
+            self._known_tables = None
             raise exc
+        finally:
+            self._in_transaction = False
+            self._pipeline = None
         self.connection.commit()
+        self._sticky_until = time.monotonic() + self.sticky_seconds
+        self._execute_deferred_statements()
+        return result
     return wrapper
 
 
@@ -31,6 +62,45 @@ class Py2SQL:
         Python to PostgreSQL mapper
     """
 
+    _DELETE_CHUNK_SIZE = 10000
+    _PIPELINE_SAVEPOINT = 'py2sqlm_pipeline'
+    _PREPARED_LIMIT = 256
+    _BYTES_IN_MB = 1024 * 1024
+
+    def __init__(self, cache=None, notify_channel=None):
+        """
+        Construct mapper
+        :param cache: optional ObjectCache for loaded objects
+        :param notify_channel: optional channel to NOTIFY about saved and deleted rows.
+        If cache is enabled as well, notifications from other processes evict cached rows
+        """
+        if cache is not None and not isinstance(cache, ObjectCache):
+            raise Exception(f'Invalid cache: {cache}')
+        if notify_channel is not None:
+            check_channel_name(notify_channel)
+        self.cache = cache
+        self.notify_channel = notify_channel
+        self._pending_notifications = {}
+        self._deferred_statements = []
+        self._in_transaction = False
+        self._pipeline = None
+        self._known_tables = None
+        self._prepared = weakref.WeakKeyDictionary()
+        self._prepared_names = counter(1)
+        self._sticky_until = 0.0
+        self._replicas = None
+        self._read_from_replica = False
+        self.sticky_seconds = 0.0
+
+    @property
+    def cache_stats(self):
+        """
+        :return: cache hits, misses, evictions and size or None if cache is disabled
+        """
+        if self.cache is None:
+            return None
+        return self.cache.stats
+
     @property
     def connection(self):
         """
@@ -41,20 +111,40 @@ class Py2SQL:
             raise Exception('No connection is established, call db_connect first')
         return self._connection
 
-    def db_connect(self, **config):
+    def db_connect(self, replicas=None, replica_selection='round_robin', sticky_seconds=1.0, **config):
         """
         Establish connection with database.
         Possible config fields: host, database, user, password, port
+        :param replicas: list of read replica configs (dicts) or DSN strings.
+        Reads outside of transactions are routed to replicas
+        :param replica_selection: 'round_robin' or 'least_loaded'
+        :param sticky_seconds: seconds after a write during which reads go to primary
+        to read own writes despite replication lag
         """
         if hasattr(self, '_connection'):
             raise Exception('Connection is already established')
+        if replicas:
+            self._replicas = ReplicaPool(replicas, replica_selection)
         self._connection = psycopg2.connect(**config)
+        self._known_tables = None
+        self._config = config
+        self.sticky_seconds = sticky_seconds
         logging.info('Database connection is established')
+        if self.cache is not None and self.notify_channel is not None:
+            self._listener = InvalidationListener(self.cache, self.notify_channel,
+                                                  ignore_pid=self._connection.get_backend_pid(), **config)
+            self._listener.start()
 
     def db_disconnect(self):
         """
         Close database connection
         """
+        if hasattr(self, '_listener'):
+            self._listener.stop()
+            del self._listener
+        if self._replicas is not None:
+            self._replicas.close()
+            self._replicas = None
         self.connection.close()
         del self._connection
         logging.info('Database connection is closed')
@@ -78,8 +168,8 @@ class Py2SQL:
         """
         :return: database size in Mb
         """
-        size = self._select_single(f"select pg_size_pretty(pg_database_size('{self.db_name}'))")
-        return self._size_kb_to_mb(size)
+        size = self._select_single('select pg_database_size(current_database())')
+        return size / self._BYTES_IN_MB
 
     @property
     def db_tables(self):
@@ -110,16 +200,623 @@ class Py2SQL:
         :param name: table name
         :return: database table size in Mb
         """
-        self._check_table_exists(name)
-        size = self._select_single(f"select pg_size_pretty(pg_total_relation_size('{name}'))")
-        return self._size_kb_to_mb(size)
+        stats = self._get_table_stats([name])
+        if name not in stats:
+            raise Exception(f'Table {name} does not exist in schema public')
+        return stats[name].total_bytes / self._BYTES_IN_MB
+
+    def table_stats(self, *classes):
+        """
+        Collect statistics of tables by a single catalog query
+        :param classes: table classes (default - all tables in public schema)
+        :return: dict of table name to TableStats
+        """
+        for clz in classes:
+            self._check_is_table(clz)
+        return self._get_table_stats([clz._table_name for clz in classes] if classes else None)
+
+    def _get_table_stats(self, names):
+        logging.debug(TABLE_STATS_QUERY)
+        rows = self._select_all(TABLE_STATS_QUERY, {'names': names})
+        return {row[0]: TableStats(*row[1:]) for row in rows}
+
+    def load_object(self, clz, key, only=None, defer=None):
+        """
+        Load object by primary key.
+        Cached object is returned without a database query if cache is enabled
+        :param clz: table class
+        :param key: primary key value
+        :param only: names of the only fields to load besides primary key and foreign keys
+        :param defer: names of fields not to load in addition to deferred fields
+        :return: loaded object or None if record does not exist
+        """
+        return self._load_objects_by_keys(clz, [key], only, defer).get(key)
+
+    def load_objects(self, clz, only=None, defer=None):
+        """
+        Load all objects of class.
+        Deferred fields are fetched on first access or by load_deferred
+        :param clz: table class
+        :param only: names of the only fields to load besides primary key and foreign keys
+        :param defer: names of fields not to load in addition to deferred fields
+        :return: list of loaded objects
+        """
+        self._check_table_exists_for_class(clz)
+        fields = self._get_loaded_fields(clz, only, defer)
+        query = f"""
+            select {', '.join([get_column_name(field) for field in fields])}
+            from {clz._table_name}
+        """
+        logging.debug(query)
+        generation = self._get_cache_generation(clz)
+        return self._hydrate(clz, fields, self._select_all(query), generation)
+
+    def select(self, clz, where=None, order_by=None, limit=None, only=None, defer=None, prepare=False):
+        """
+        Load objects matching condition built from field descriptors,
+        e.g. (City.capital == True) | City.id.in_(ids).
+        SQL is compiled once per query shape and cached, values are passed as parameters
+        :param clz: table class
+        :param where: condition
+        :param order_by: field or list of fields to order by
+        :param limit: maximum number of objects
+        :param only: names of the only fields to load besides primary key and foreign keys
+        :param defer: names of fields not to load in addition to deferred fields
+        :param prepare: execute as server-side prepared statement, it is prepared once per connection
+        :return: list of loaded objects
+        """
+        self._check_is_table(clz)
+        fields = self._get_loaded_fields(clz, only, defer)
+        params = []
+        shape = get_shape(clz, where, params) if where is not None else None
+        order_columns = tuple([get_column_name(field) for field in self._resolve_fields(clz, order_by)])
+        query = compile_select(clz._table_name, tuple([get_column_name(field) for field in fields]),
+                               shape, order_columns, limit is not None)
+        if limit is not None:
+            params.append(limit)
+        logging.debug(query)
+        generation = self._get_cache_generation(clz)
+        rows = self._select(query, params, lambda cursor: cursor.fetchall(), prepare)
+        return self._hydrate(clz, fields, rows, generation)
+
+    def iter_pages(self, clz, page_size=1000, order_by=None, after=None, only=None, defer=None,
+                   where=None, params=None):
+        """
+        Iterate over all objects of class by pages using keyset pagination.
+        Every page is selected by an index seek, so its latency does not depend on page depth.
+        Order columns should not contain nulls
+        :param clz: table class
+        :param page_size: maximum number of objects in page
+        :param order_by: field name or list of field names which are primary key
+        or leading columns of a declared index (default - primary key)
+        :param after: cursor returned with a page to continue iteration after it
+        :param only: names of the only fields to load besides primary key and foreign keys
+        :param defer: names of fields not to load in addition to deferred fields
+        :param where: condition or SQL condition
+        :param params: SQL condition query parameters
+        :return: generator of tuples (list of objects, cursor)
+        """
+        if not isinstance(page_size, int) or page_size < 1:
+            raise Exception(f'Invalid page size: {page_size}')
+        self._check_table_exists_for_class(clz)
+        where, params = self._get_where(clz, where, params)
+        order_columns = self._get_keyset_columns(clz, order_by)
+        fields = self._get_loaded_fields(clz, only, defer)
+        columns = ', '.join(order_columns + [get_column_name(field) for field in fields])
+        order = ', '.join(order_columns)
+        first_page_query = f"""
+            select {columns} from {clz._table_name}
+            {f'where {where}' if where else ''}
+            order by {order}
+            limit %s
+        """
+        next_page_query = f"""
+            select {columns} from {clz._table_name}
+            where ({order}) > ({', '.join(['%s'] * len(order_columns))})
+            {f'and ({where})' if where else ''}
+            order by {order}
+            limit %s
+        """
+        params = list(params or [])
+        last_values = decode_cursor(clz._table_name, after) if after is not None else None
+        while True:
+            generation = self._get_cache_generation(clz)
+            if last_values is None:
+                logging.debug(first_page_query)
+                rows = self._select_all(first_page_query, (*params, page_size))
+            else:
+                logging.debug(next_page_query)
+                rows = self._select_all(next_page_query, (*last_values, *params, page_size))
+            if not rows:
+                return
+            last_values = list(rows[-1][:len(order_columns)])
+            objects = self._hydrate(clz, fields, [row[len(order_columns):] for row in rows], generation)
+            yield objects, encode_cursor(clz._table_name, last_values)
+            if len(rows) < page_size:
+                return
+
+    def _get_keyset_columns(self, clz, order_by):
+        primary_key_column = get_column_name(get_primary_key(clz))
+        if order_by is None:
+            return [primary_key_column]
+        field_names = [order_by] if isinstance(order_by, str) else list(order_by)
+        self._check_field_names(clz, field_names)
+        columns = [get_column_name(clz.__dict__[field_name]) for field_name in field_names]
+        if columns[0] == primary_key_column:
+            return [primary_key_column]
+        for index in get_class_indexes(clz):
+            index_columns = index.columns(clz)
+            if index.method != 'btree' or index_columns[:len(columns)] != columns:
+                continue
+            if index.unique and len(index_columns) == len(columns):
+                return columns
+            return columns + [primary_key_column]
+        raise Exception(f'Columns {columns} of {clz.__name__} are not primary key or leading columns of an index')
+
+    def aggregate(self, clz, count=None, sum=None, avg=None, min=None, max=None,
+                  group_by=None, where=None, params=None, as_dict=False):
+        """
+        Compute aggregates by a single query in database.
+        Fields can be specified by name or by class attribute, e.g. sum=GeoInfo.area
+        :param clz: table class
+        :param count: True to count rows or field(s) to count not null values
+        :param sum: field or list of fields to sum
+        :param avg: field or list of fields to average
+        :param min: field or list of fields to find minimum
+        :param max: field or list of fields to find maximum
+        :param group_by: field or list of fields to group by
+        :param where: condition or SQL condition
+        :param params: SQL condition query parameters
+        :param as_dict: return dicts keyed by group field names and 'count' or '<function>_<field>'
+        :return: list of tuples of group values followed by aggregates in count, sum, avg, min, max order
+        """
+        self._check_table_exists_for_class(clz)
+        where, params = self._get_where(clz, where, params)
+        group_fields = self._resolve_fields(clz, group_by)
+        names = [field.name for field in group_fields]
+        columns = [get_column_name(field) for field in group_fields]
+        if count is True:
+            names.append('count')
+            columns.append('count(*)')
+        elif count:
+            for field in self._resolve_fields(clz, count):
+                names.append(f'count_{field.name}')
+                columns.append(f'count({get_column_name(field)})')
+        for function, fields in (('sum', sum), ('avg', avg), ('min', min), ('max', max)):
+            for field in self._resolve_fields(clz, fields):
+                if function in ('sum', 'avg') and not isinstance(field, (IntField, FloatField)):
+                    raise Exception(f'Can not compute {function} of non-numeric field {field.name}')
+                names.append(f'{function}_{field.name}')
+                columns.append(f'{function}({get_column_name(field)})')
+        if len(columns) == len(group_fields):
+            raise Exception('At least one aggregate should be specified')
+        group_columns = ', '.join([get_column_name(field) for field in group_fields])
+        query = f"""
+            select {', '.join(columns)}
+            from {clz._table_name}
+            {f'where {where}' if where else ''}
+            {f'group by {group_columns} order by {group_columns}' if group_fields else ''}
+        """
+        logging.debug(query)
+        rows = self._select_all(query, params)
+        if as_dict:
+            return [dict(zip(names, row)) for row in rows]
+        return [tuple(row) for row in rows]
+
+    @staticmethod
+    def _get_where(clz, where, params):
+        if not isinstance(where, Condition):
+            return where, params
+        if params:
+            raise Exception('Parameters can be specified only for SQL condition')
+        return compile_condition(clz, where)
+
+    def _resolve_fields(self, clz, fields):
+        if fields is None:
+            return []
+        if isinstance(fields, (str, DatabaseField)):
+            fields = [fields]
+        resolved_fields = []
+        for field in fields:
+            if isinstance(field, str):
+                self._check_field_names(clz, [field])
+                field = clz.__dict__[field]
+            elif not isinstance(field, DatabaseField) or clz.__dict__.get(field.name) is not field:
+                raise Exception(f'{field} is not a database field of {clz.__name__}')
+            resolved_fields.append(field)
+        return resolved_fields
+
+    def load_columns(self, clz, fields, where=None, params=None, chunk_size=65536):
+        """
+        Load columns of table into NumPy arrays (array.array if NumPy is not installed)
+        without creating objects. Rows are streamed with binary COPY.
+        IntField is loaded as int64, FloatField as float32 (null as NaN), BoolField as bool
+        :param clz: table class
+        :param fields: field names or class attributes to load
+        :param where: condition or SQL condition
+        :param params: SQL condition query parameters
+        :param chunk_size: array growth step
+        :return: dict of field name to array
+        """
+        self._check_table_exists_for_class(clz)
+        where, params = self._get_where(clz, where, params)
+        fields = self._resolve_fields(clz, fields)
+        if not fields:
+            raise Exception('At least one field should be specified')
+        from py2sqlm.columns import BinaryCopyReader, get_select_column
+        select = f"""
+            select {', '.join([get_select_column(field) for field in fields])}
+            from {clz._table_name}
+            {f'where {where}' if where else ''}
+        """
+
+        def copy(cursor):
+            reader = BinaryCopyReader(fields, chunk_size)
+            query = f"copy ({cursor.mogrify(select, params).decode()}) to stdout with (format binary)"
+            logging.debug(query)
+            cursor.copy_expert(query, reader)
+            return reader.result()
+
+        return self._read(copy)
+
+    def load_deferred(self, objects, *field_names):
+        """
+        Fetch not loaded fields and linked many relations of objects by one query per class and relation
+        :param objects: loaded objects
+        :param field_names: names of fields and relations to fetch (default - all not loaded ones)
+        """
+        objects_by_class = {}
+        for obj in objects:
+            objects_by_class.setdefault(obj.__class__, []).append(obj)
+        for clz, class_objects in objects_by_class.items():
+            fields = get_class_database_fields(clz)
+            relations = [relation for relation in get_many_relations(clz) if relation.is_linked]
+            if field_names:
+                self._check_field_names(clz, field_names, relations)
+                fields = [field for field in fields if field.name in field_names]
+                relations = [relation for relation in relations if relation.name in field_names]
+            fields = [field for field in fields if any(not field.is_loaded(obj) for obj in class_objects)]
+            if fields:
+                self._fetch_fields(clz, [obj for obj in class_objects if any(
+                    not field.is_loaded(obj) for field in fields)], fields)
+            for relation in relations:
+                self._fetch_relation(relation, [obj for obj in class_objects if not relation.is_loaded(obj)])
+
+    def _load_deferred_field(self, obj, field):
+        if isinstance(field, ManyRelation):
+            self._fetch_relation(field, [obj])
+            return
+        self._fetch_fields(obj.__class__, [obj], [field])
+        if not field.is_loaded(obj):
+            key = getattr(obj, get_primary_key(obj.__class__).name)
+            raise Exception(f'Failed to load {field.name} of {obj.__class__.__name__} {key}: row does not exist')
+
+    def _fetch_fields(self, clz, objects, fields):
+        primary_key = get_primary_key(clz)
+        query = f"""
+            select {get_column_name(primary_key)}, {', '.join([get_column_name(field) for field in fields])}
+            from {clz._table_name}
+            where {get_column_name(primary_key)} = any(%s)
+        """
+        logging.debug(query)
+        objects_by_key = {getattr(obj, primary_key.name): obj for obj in objects}
+        rows = self._select_all(query, (list(objects_by_key),))
+        referenced_objects = {}
+        for i, field in enumerate(fields):
+            if isinstance(field, ForeignKey):
+                referenced_objects[field] = self._load_objects_by_keys(
+                    field.mapping_class, [row[i + 1] for row in rows if row[i + 1] is not None])
+        for row in rows:
+            obj = objects_by_key[row[0]]
+            for field, value in zip(fields, row[1:]):
+                if isinstance(field, ForeignKey):
+                    value = referenced_objects[field].get(value)
+                if not field.is_loaded(obj):
+                    setattr(obj, field.name, value)
+
+    def _fetch_relation(self, relation, objects):
+        if not objects:
+            return
+        clz = relation.owner
+        mapping_class = relation.mapping_class
+        if relation.back_reference:
+            query = f"""
+                select {relation.back_reference}, {get_column_name(get_primary_key(mapping_class))}
+                from {mapping_class._table_name}
+                where {relation.back_reference} = any(%s)
+                order by 2
+            """
+        else:
+            query = f"""
+                select {relation.owner_column}, {relation.mapping_column}
+                from {relation.join_table}
+                where {relation.owner_column} = any(%s)
+                order by 2
+            """
+        logging.debug(query)
+        primary_key = get_primary_key(clz)
+        objects_by_key = {getattr(obj, primary_key.name): obj for obj in objects}
+        rows = self._select_all(query, (list(objects_by_key),))
+        mapping_objects = self._load_objects_by_keys(mapping_class, [row[1] for row in rows])
+        keys_by_owner = {key: [] for key in objects_by_key}
+        for owner_key, key in rows:
+            keys_by_owner[owner_key].append(key)
+        for owner_key, keys in keys_by_owner.items():
+            obj = objects_by_key[owner_key]
+            if not relation.is_loaded(obj):
+                setattr(obj, relation.name, [mapping_objects[key] for key in keys if key in mapping_objects])
+
+    def _get_loaded_fields(self, clz, only, defer):
+        fields = get_class_database_fields(clz)
+        primary_key = get_primary_key(clz)
+        # foreign keys can not be deferred, they are always loaded
+        required_fields = [field for field in fields if field is primary_key or isinstance(field, ForeignKey)]
+        if only is not None:
+            self._check_field_names(clz, only)
+            return [field for field in fields if field in required_fields or field.name in only]
+        defer = defer or []
+        self._check_field_names(clz, defer)
+        return [field for field in fields
+                if field in required_fields or not (field.deferred or field.name in defer)]
+
+    @staticmethod
+    def _check_field_names(clz, field_names, relations=()):
+        names = [field.name for field in get_class_database_fields(clz)] + [relation.name for relation in relations]
+        for field_name in field_names:
+            if field_name not in names:
+                raise Exception(f'{field_name} is not a database field of {clz.__name__}')
+
+    def _load_objects_by_keys(self, clz, keys, only=None, defer=None):
+        objects = {}
+        missing_keys = []
+        for key in dict.fromkeys(keys):
+            obj = self.cache.get(clz, key) if self.cache is not None else None
+            if obj is None:
+                missing_keys.append(key)
+            else:
+                objects[key] = obj
+        if not missing_keys:
+            return objects
+        self._check_table_exists_for_class(clz)
+        fields = self._get_loaded_fields(clz, only, defer)
+        primary_key = get_primary_key(clz)
+        query = f"""
+            select {', '.join([get_column_name(field) for field in fields])}
+            from {clz._table_name}
+            where {get_column_name(primary_key)} = any(%s)
+        """
+        logging.debug(query)
+        generation = self._get_cache_generation(clz)
+        for obj in self._hydrate(clz, fields, self._select_all(query, (missing_keys,)), generation):
+            objects[getattr(obj, primary_key.name)] = obj
+        return objects
+
+    def _get_cache_generation(self, clz):
+        return self.cache.generation(clz._table_name) if self.cache is not None else None
+
+    def _hydrate(self, clz, fields, rows, generation):
+        # rows read from a lagging replica may predate writes which already invalidated cache
+        is_cacheable = self.cache is not None and not self._read_from_replica
+        objects = []
+        referenced_keys = {}
+        relations = get_many_relations(clz)
+        is_partial = len(fields) < len(get_class_database_fields(clz)) or any(
+            relation.is_linked for relation in relations)
+        for row in rows:
+            obj = clz.__new__(clz)
+            if is_partial:
+                set_deferred_loader(obj, self._load_deferred_field)
+            for field, value in zip(fields, row):
+                if isinstance(field, ForeignKey):
+                    referenced_keys.setdefault(field, []).append(value)
+                else:
+                    setattr(obj, field.name, value)
+            for relation in relations:
+                if not relation.is_linked:
+                    setattr(obj, relation.name, [])
+            objects.append(obj)
+        for field, keys in referenced_keys.items():
+            referenced_objects = self._load_objects_by_keys(
+                field.mapping_class, [key for key in keys if key is not None])
+            for obj, key in zip(objects, keys):
+                setattr(obj, field.name, referenced_objects.get(key))
+        if is_cacheable:
+            for obj in objects:
+                self.cache.put(obj, generation)
+        return objects
+
+    def parallel_load(self, clz, source, workers=None, shard_size=10000, method='copy', retries=3, progress=None):
+        """
+        Load objects or CSV file into table by pool of worker processes.
+        Each worker has its own connection and loads every shard in a separate transaction,
+        so shards committed before a failure stay loaded.
+        Objects referenced by foreign keys are loaded first, parent tables before children,
+        existing referenced rows are skipped
+        :param clz: table class
+        :param source: iterable of clz objects or path of CSV file with header of column names,
+        every CSV record should be a single line
+        :param workers: number of worker processes (default - number of CPUs)
+        :param shard_size: number of rows loaded in one transaction
+        :param method: 'copy' to load with COPY or 'insert' to load with batched inserts
+        :param retries: number of shard retries on operational errors
+        :param progress: callback called with class and number of loaded rows after each shard
+        :return: number of loaded clz rows
+        """
+        if method not in ('copy', 'insert'):
+            raise Exception(f'Invalid load method: {method}')
+        self._check_table_exists_for_class(clz)
+        workers = workers or os.cpu_count()
+        if is_path(source):
+            if method != 'copy':
+                raise Exception('CSV file can be loaded only with copy method')
+            columns, shards = read_csv_shards(source, shard_size)
+            levels = [(clz, columns, shards, method)]
+        else:
+            levels = self._get_load_levels(clz, source, shard_size, method)
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self._config,)) as executor:
+            for level_clz, columns, shards, level_method in levels:
+                count = self._load_level(executor, workers, level_clz, columns, shards, level_method, retries, progress)
+        self._invalidate_classes([level[0] for level in levels])
+        return count
+
+    def _get_load_levels(self, clz, objects, shard_size, method):
+        fields = get_class_database_fields(clz)
+        columns = [get_column_name(field) for field in fields]
+        if not any(isinstance(field, ForeignKey) for field in fields):
+            rows = map(get_object_row, objects)
+            return [(clz, columns, self._to_shards(rows, shard_size), method)]
+        rows = []
+        referenced_objects = {}
+        for obj in objects:
+            rows.append(get_object_row(obj))
+            self._collect_referenced_objects(obj, referenced_objects)
+        levels = []
+        for referenced_class in self._get_dependency_order(referenced_objects):
+            self._check_table_exists_for_class(referenced_class)
+            referenced_columns = [get_column_name(field) for field in get_class_database_fields(referenced_class)]
+            referenced_rows = map(get_object_row, referenced_objects[referenced_class].values())
+            levels.append((referenced_class, referenced_columns, self._to_shards(referenced_rows, shard_size), 'insert'))
+        levels.append((clz, columns, self._to_shards(rows, shard_size), method))
+        return levels
+
+    @staticmethod
+    def _to_shards(rows, shard_size):
+        return ((shard, len(shard)) for shard in chunks(rows, shard_size))
+
+    def _collect_referenced_objects(self, obj, referenced_objects):
+        for field in get_class_database_fields(obj.__class__):
+            if not isinstance(field, ForeignKey):
+                continue
+            referenced_object = getattr(obj, field.name)
+            if referenced_object is None:
+                continue
+            referenced_class = referenced_object.__class__
+            key = getattr(referenced_object, get_primary_key(referenced_class).name)
+            objects = referenced_objects.setdefault(referenced_class, {})
+            if key not in objects:
+                objects[key] = referenced_object
+                self._collect_referenced_objects(referenced_object, referenced_objects)
+
+    @staticmethod
+    def _get_dependency_order(classes):
+        ordered_classes = []
+
+        def visit(clz):
+            if clz in ordered_classes:
+                return
+            for field in get_class_database_fields(clz):
+                if isinstance(field, ForeignKey) and field.mapping_class in classes and field.mapping_class is not clz:
+                    visit(field.mapping_class)
+            ordered_classes.append(clz)
+
+        for clz in classes:
+            visit(clz)
+        return ordered_classes
+
+    def _load_level(self, executor, workers, clz, columns, shards, method, retries, progress):
+        from concurrent.futures import FIRST_COMPLETED, wait
+        loaded = 0
+        futures = set()
+
+        def collect(done_futures):
+            nonlocal loaded
+            for future in done_futures:
+                loaded += future.result()
+                if progress is not None:
+                    progress(clz, loaded)
+
+        conflict_columns = get_key_columns(clz)
+        for shard, size in shards:
+            if len(futures) >= 2 * workers:
+                done_futures, futures = wait(futures, return_when=FIRST_COMPLETED)
+                collect(done_futures)
+            futures.add(executor.submit(load_shard, self._config, clz._table_name, columns, shard,
+                                        method, conflict_columns, retries))
+        collect(wait(futures)[0])
+        logging.info(f'Loaded {loaded} rows into {clz._table_name}')
+        return loaded
+
+    @transactional
+    def _invalidate_classes(self, classes):
+        for clz in classes:
+            self._invalidate_class(clz)
+
+    @transactional
+    def sync_objects(self, clz, objects, unlogged=False):
+        """
+        Make table contain exactly the specified objects.
+        Objects are copied into a staging table, then changed rows are upserted
+        and missing rows are deleted by set-based statements
+        :param clz: table class
+        :param objects: iterable of all clz objects
+        :param unlogged: stage in an unlogged table instead of a temporary one
+        :return: dict of inserted, updated and deleted row counts
+        """
+        return self._sync_objects(clz, objects, unlogged)
+
+    def _sync_objects(self, clz, objects, unlogged):
+        self._check_table_exists_for_class(clz)
+        table_name = clz._table_name
+        columns = [get_column_name(field) for field in get_class_database_fields(clz)]
+        key_columns = get_key_columns(clz)
+        value_columns = [column for column in columns if column not in key_columns]
+        if unlogged:
+            stage_name = f'{table_name}_stage_{self.connection.get_backend_pid()}'
+            query = f'create unlogged table {stage_name} (like {table_name})'
+        else:
+            stage_name = f'{table_name}_stage'
+            query = f'create temp table {stage_name} (like {table_name}) on commit drop'
+        logging.debug(query)
+        self._execute(query)
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(f"copy {stage_name} ({', '.join(columns)}) from stdin with (format csv)",
+                               CsvRowsReader(map(get_object_row, objects)))
+        self._execute(f"alter table {stage_name} add primary key ({', '.join(key_columns)})")
+        self._execute(f'analyze {stage_name}')
+        if value_columns:
+            conflict_action = f"""
+                do update set {', '.join([f'{column} = excluded.{column}' for column in value_columns])}
+                where ({', '.join([f'{table_name}.{column}' for column in value_columns])})
+                is distinct from ({', '.join([f'excluded.{column}' for column in value_columns])})
+            """
+        else:
+            conflict_action = 'do nothing'
+        query = f"""
+            with upserted as (
+                insert into {table_name} ({', '.join(columns)})
+                select {', '.join(columns)} from {stage_name}
+                on conflict ({', '.join(key_columns)}) {conflict_action}
+                returning (xmax = 0) as inserted
+            )
+            select count(*) filter (where inserted), count(*) filter (where not inserted) from upserted
+        """
+        logging.debug(query)
+        inserted, updated = self._select_all(query)[0]
+        query = f"""
+            delete from {table_name} t
+            where not exists (
+                select 1 from {stage_name} s
+                where {' and '.join([f's.{column} = t.{column}' for column in key_columns])}
+            )
+        """
+        logging.debug(query)
+        deleted = self._execute(query)
+        if unlogged:
+            self._execute(f'drop table {stage_name}')
+        if inserted or updated or deleted:
+            self._invalidate_class(clz)
+        return {'inserted': inserted, 'updated': updated, 'deleted': deleted}
 
     @transactional
     def save_object(self, obj):
         """
-        Create or replace object and child objects in database
+        Create or replace object and child objects in database.
+        Tables are checked against known tables without a catalog query and all writes
+        of the object graph are sent together in one multi-statement batch
         :param obj: object to save
         """
+        self._pipeline = []
         self._save_object(obj)
 
     def _save_object(self, obj):
@@ -130,52 +827,85 @@ class Py2SQL:
         fields = get_class_database_fields(clz)
         referenced_fields = list(filter(lambda field: isinstance(field, ForeignKey), fields))
         referenced_objects = [getattr(obj, referenced_table.name) for referenced_table in referenced_fields]
-        fields_referenced_to = list(filter(lambda field: isinstance(field, ManyRelation), clz.__dict__.values()))
+        fields_referenced_to = [relation for relation in get_many_relations(clz) if relation.is_loaded(obj)]
         objects_referenced_to = []
         for field_referenced_to in fields_referenced_to:
             objects_referenced_to += getattr(obj, field_referenced_to.name)
 
         for referenced_object in referenced_objects:
             self._save_object(referenced_object)
-        if self._record_exists(obj):
-            self._replace_object(obj)
-        else:
-            self._create_object(obj)
+        self._upsert_object(obj)
+        self._invalidate_object(clz, getattr(obj, get_primary_key(clz).name))
         for object_referenced_to in objects_referenced_to:
             self._save_object(object_referenced_to)
+        for field_referenced_to in fields_referenced_to:
+            if field_referenced_to.is_linked:
+                self._save_links(obj, field_referenced_to)
 
-    def _create_object(self, obj):
-        table_name, field_names, field_values = self._get_object_info(obj)
-        query = f"""
-            insert into {table_name} ({', '.join(field_names)}) 
-            values ({', '.join([self._format_field(field_value) for field_value in field_values])})
-        """
-        logging.debug(query)
-        self._execute(query)
+    def _save_links(self, obj, relation):
+        key = getattr(obj, get_primary_key(relation.owner).name)
+        mapping_key = get_primary_key(relation.mapping_class)
+        keys = [getattr(mapping_object, mapping_key.name) for mapping_object in getattr(obj, relation.name)]
+        mapping_table = relation.mapping_class._table_name
+        mapping_column = get_column_name(mapping_key)
+        if relation.back_reference:
+            unlink_query = f"""
+                update {mapping_table} set {relation.back_reference} = null
+                where {relation.back_reference} = %s and not ({mapping_column} = any(%s))
+            """
+            link_query = f"""
+                update {mapping_table} as t set {relation.back_reference} = %s
+                from {mapping_table} as old
+                where t.{mapping_column} = old.{mapping_column} and t.{mapping_column} = any(%s)
+                and t.{relation.back_reference} is distinct from %s
+                returning old.{relation.back_reference}
+            """
+            logging.debug(unlink_query)
+            self._queue(unlink_query, (key, keys), obj)
+            logging.debug(link_query)
+            self._queue(link_query, (key, keys, key), obj, lambda rows: [
+                self._invalidate_object(relation.owner, row[0]) for row in rows if row[0] is not None])
+        else:
+            unlink_query = f"""
+                delete from {relation.join_table}
+                where {relation.owner_column} = %s and not ({relation.mapping_column} = any(%s))
+            """
+            link_query = f"""
+                insert into {relation.join_table} ({relation.owner_column}, {relation.mapping_column})
+                select %s, unnest(%s::{mapping_key.column_type}[])
+                on conflict do nothing
+            """
+            logging.debug(unlink_query)
+            self._queue(unlink_query, (key, keys), obj)
+            logging.debug(link_query)
+            self._queue(link_query, (key, keys), obj)
 
-    def _replace_object(self, obj):
+    def _upsert_object(self, obj):
         table_name, field_names, field_values = self._get_object_info(obj)
-        primary_key = get_primary_key(obj.__class__)
+        key_columns = get_key_columns(obj.__class__)
+        update_names = [field_name for field_name in field_names if field_name not in key_columns]
+        if update_names:
+            conflict_action = f"do update set {', '.join([f'{name} = excluded.{name}' for name in update_names])}"
+        else:
+            conflict_action = 'do nothing'
         query = f"""
-            update {table_name}
-            set {', '.join([f'{field[0]} = {self._format_field(field[1])}' for field in zip(field_names, field_values)])}
-            where {primary_key.name} = {getattr(obj, primary_key.name)}
+            insert into {table_name} ({', '.join(field_names)})
+            values ({', '.join(['%s'] * len(field_names))})
+            on conflict ({', '.join(key_columns)}) {conflict_action}
         """
         logging.debug(query)
-        self._execute(query)
+        self._queue(query, to_sql_row(field_values), obj)
 
     def _get_object_info(self, obj):
         clz = obj.__class__
         table_name = clz._table_name
-        fields = get_class_database_fields(clz)
+        fields = [field for field in get_class_database_fields(clz) if field.is_loaded(obj)]
         field_names = [self._get_table_column_name(obj, field) for field in fields]
         field_values = [self._get_table_column_value(obj, field) for field in fields]
         return (table_name, field_names, field_values)
 
     def _get_table_column_name(self, obj, field):
-        if isinstance(field, ForeignKey):
-            return field.mapping_column
-        return field.name
+        return get_column_name(field)
 
     def _get_table_column_value(self, obj, field):
         if not isinstance(field, ForeignKey):
@@ -185,20 +915,6 @@ class Py2SQL:
             return
         return getattr(child_obj, get_primary_key(child_obj.__class__).name)
 
-    def _record_exists(self, obj):
-        clz = obj.__class__
-        self._check_table_exists_for_class(clz)
-        primary_key = get_primary_key(clz)
-        table_name = clz._table_name
-        id_name = primary_key.name
-        id_value = getattr(obj, id_name)
-        query = f"""
-            select count(*) from {table_name} where {id_name} = {id_value}
-        """
-        logging.debug(query)
-        count = self._select_single(query)
-        return count == 1
-
     @transactional
     def save_class(self, clz):
         """
@@ -210,28 +926,148 @@ class Py2SQL:
     def _save_class(self, clz):
         self._check_is_table(clz)
         table_name = clz._table_name
+        deferred_count = len(self._deferred_statements)
         if table_name in self.db_tables:
             self._update_class(clz)
         else:
             self._create_class(clz)
+        if isinstance(clz._table_partitioning, RangePartitioning):
+            self._create_partitions(clz, clz._table_partitioning.ahead)
+        self._save_relations(clz)
+        query = f"""
+            comment on table {table_name} is %s
+        """
+        logging.debug(query)
+        if len(self._deferred_statements) == deferred_count:
+            self._execute(query, (self._get_schema_comment(clz),))
+            return
+        # fingerprint is written only after concurrent index builds succeed
+        self._execute(query, (None,))
+        self._deferred_statements.append(self._mogrify(query, (self._get_schema_comment(clz),)))
 
     @transactional
     def save_hierarchy(self, root_class):
         """
-        Create or replace class and child classes in database
+        Create or replace class and child classes in database.
+        Mapping classes of linked many relations are saved as well.
+        Schema fingerprints of all classes are verified by one catalog query,
+        classes which did not change since they were saved are skipped
         :param root_class: class to save
         """
         self._save_hierarchy(root_class)
 
     def _save_hierarchy(self, clz):
+        classes = self._get_hierarchy_classes(clz, [])
+        query = """
+            select c.relname, obj_description(c.oid, 'pg_class')
+            from pg_catalog.pg_class c
+            where c.relnamespace = 'public'::regnamespace and c.relkind in ('r', 'p') and c.relname = any(%s)
+        """
+        logging.debug(query)
+        comments = dict(self._select_all(query, ([hierarchy_class._table_name for hierarchy_class in classes],)))
+        for hierarchy_class in classes:
+            if not self._is_schema_saved(hierarchy_class, comments.get(hierarchy_class._table_name)):
+                self._save_class(hierarchy_class)
+
+    def _get_hierarchy_classes(self, clz, classes):
         self._check_is_table(clz)
+        if clz in classes:
+            return classes
         fields = get_class_database_fields(clz)
         refererenced_tables = list(filter(lambda field: isinstance(field, ForeignKey), fields))
         for refererenced_table in refererenced_tables:
-            self._save_hierarchy(refererenced_table.mapping_class)
-        self._save_class(clz)
+            if refererenced_table.mapping_class is not clz:
+                self._get_hierarchy_classes(refererenced_table.mapping_class, classes)
+        classes.append(clz)
+        for relation in get_many_relations(clz):
+            if relation.is_linked:
+                self._get_hierarchy_classes(relation.mapping_class, classes)
+        return classes
+
+    @staticmethod
+    def _get_schema_comment(clz):
+        comment = SCHEMA_COMMENT_PREFIX + clz._table_fingerprint
+        if isinstance(clz._table_partitioning, RangePartitioning):
+            partitioning = clz._table_partitioning
+            comment += f' {partitioning.last_period_start(datetime.now(), partitioning.ahead):%Y%m%d}'
+        return comment
+
+    @staticmethod
+    def _is_schema_saved(clz, comment):
+        if not comment or not comment.startswith(SCHEMA_COMMENT_PREFIX):
+            return False
+        saved = comment[len(SCHEMA_COMMENT_PREFIX):].split()
+        if saved[0] != clz._table_fingerprint:
+            return False
+        if not isinstance(clz._table_partitioning, RangePartitioning):
+            return True
+        partitioning = clz._table_partitioning
+        last_period_start = partitioning.last_period_start(datetime.now(), partitioning.ahead)
+        return len(saved) == 2 and saved[1] >= f'{last_period_start:%Y%m%d}'
+
+    def _save_relations(self, clz):
+        tables = self.db_tables
+        relations = [relation for relation in get_many_relations(clz) if relation.is_linked]
+        relations += [relation for relation in get_mapped_relations(clz) if relation.owner is not clz]
+        for relation in relations:
+            if relation.owner._table_name in tables and relation.mapping_class._table_name in tables:
+                if relation.back_reference:
+                    self._create_back_reference(relation)
+                else:
+                    self._create_join_table(relation)
+
+    def _create_back_reference(self, relation):
+        owner_key = get_primary_key(relation.owner)
+        mapping_table = relation.mapping_class._table_name
+        column = relation.back_reference
+        query = f"""
+            alter table {mapping_table} add column if not exists {column} {owner_key.column_type}
+        """
+        logging.debug(query)
+        self._execute(query)
+        constraint_query = """
+            select count(*) from pg_catalog.pg_constraint where conname = %s and conrelid = %s::regclass
+        """
+        logging.debug(constraint_query)
+        if not self._select_single(constraint_query, (f'{mapping_table}_{column}_fkey', mapping_table)):
+            query = f"""
+                alter table {mapping_table} add constraint {mapping_table}_{column}_fkey
+                foreign key ({column}) references {relation.owner._table_name} ({get_column_name(owner_key)})
+                on delete set null
+            """
+            logging.debug(query)
+            self._execute(query)
+        query = f"""
+            create index if not exists {mapping_table}_{column}_link_idx on {mapping_table} ({column})
+        """
+        logging.debug(query)
+        self._execute(query)
+
+    def _create_join_table(self, relation):
+        owner_key = get_primary_key(relation.owner)
+        mapping_key = get_primary_key(relation.mapping_class)
+        query = f"""
+            create table if not exists {relation.join_table} (
+                {relation.owner_column} {owner_key.column_type} not null
+                    references {relation.owner._table_name} ({get_column_name(owner_key)}) on delete cascade,
+                {relation.mapping_column} {mapping_key.column_type} not null
+                    references {relation.mapping_class._table_name} ({get_column_name(mapping_key)}) on delete cascade,
+                primary key ({relation.owner_column}, {relation.mapping_column})
+            )
+        """
+        logging.debug(query)
+        self._execute(query)
+        query = f"""
+            create index if not exists {relation.join_table}_{relation.mapping_column}_idx
+            on {relation.join_table} ({relation.mapping_column})
+        """
+        logging.debug(query)
+        self._execute(query)
 
     def _create_class(self, clz):
+        if clz._table_partitioning is not None:
+            self._create_partitioned_class(clz)
+            return
         fields = get_class_database_fields(clz)
         column_separator = ', \n\t\t\t\t'
         query = f"""
@@ -241,20 +1077,183 @@ class Py2SQL:
         """
         logging.debug(query)
         self._execute(query)
+        for index in get_class_indexes(clz):
+            self._create_index(clz, index)
+
+    def _create_partitioned_class(self, clz):
+        fields = get_class_database_fields(clz)
+        partitioning = clz._table_partitioning
+        primary_key_columns = get_key_columns(clz)
+        partition_column = primary_key_columns[-1]
+        definitions = [field.column_definition if field.primary_key else field.definition for field in fields]
+        definitions.append(f"primary key ({', '.join(primary_key_columns)})")
+        column_separator = ', \n\t\t\t\t'
+        query = f"""
+            create table {clz._table_name} (
+                {column_separator.join(definitions)}
+            ) partition by {partitioning.method} ({partition_column})
+        """
+        logging.debug(query)
+        self._execute(query)
+        if not isinstance(partitioning, RangePartitioning):
+            for remainder in range(partitioning.partitions):
+                query = f"""
+                    create table {partitioning.partition_name(clz._table_name, remainder)}
+                    partition of {clz._table_name}
+                    for values with (modulus {partitioning.partitions}, remainder {remainder})
+                """
+                logging.debug(query)
+                self._execute(query)
+        for index in get_class_indexes(clz):
+            self._create_index(clz, index)
+
+    @transactional
+    def create_partitions(self, clz, ahead=None, start=None):
+        """
+        Create missing range partitions from start up to ahead intervals after now
+        :param clz: range partitioned class
+        :param ahead: number of upcoming partitions (default - specified in by_range)
+        :param start: datetime of the first partition to create (default - now)
+        :return: names of created partitions
+        """
+        return self._create_partitions(clz, ahead, start)
+
+    def _create_partitions(self, clz, ahead=None, start=None):
+        partitioning = self._get_range_partitioning(clz)
+        if ahead is None:
+            ahead = partitioning.ahead
+        now = datetime.now()
+        period_start = partitioning.period_start(min(start, now) if start is not None else now)
+        last_period_start = partitioning.last_period_start(now, ahead)
+        actual_partitions = set(self._get_partitions(clz))
+        created_partitions = []
+        while period_start <= last_period_start:
+            period_end = partitioning.next_period_start(period_start)
+            partition_name = partitioning.partition_name(clz._table_name, period_start)
+            if partition_name not in actual_partitions:
+                query = f"""
+                    create table {partition_name} partition of {clz._table_name}
+                    for values from ('{period_start.isoformat(sep=' ')}') to ('{period_end.isoformat(sep=' ')}')
+                """
+                logging.debug(query)
+                self._execute(query)
+                created_partitions.append(partition_name)
+            period_start = period_end
+        return created_partitions
+
+    @transactional
+    def drop_partitions(self, clz, older_than):
+        """
+        Drop range partitions which contain only rows older than specified moment.
+        It is much faster than deleting rows one by one
+        :param clz: range partitioned class
+        :param older_than: datetime
+        :return: names of dropped partitions
+        """
+        return self._drop_partitions(clz, older_than)
+
+    def _drop_partitions(self, clz, older_than):
+        self._known_tables = None
+        partitioning = self._get_range_partitioning(clz)
+        dropped_partitions = []
+        for partition_name in self._get_partitions(clz):
+            period_start = partitioning.partition_start(partition_name)
+            if period_start is None or partitioning.next_period_start(period_start) > older_than:
+                continue
+            query = f"""
+                drop table {partition_name}
+            """
+            logging.debug(query)
+            self._execute(query)
+            dropped_partitions.append(partition_name)
+        if dropped_partitions:
+            self._invalidate_class(clz)
+        return sorted(dropped_partitions)
+
+    def _get_partitions(self, clz):
+        query = """
+            select c.relname
+            from pg_catalog.pg_inherits i
+            join pg_catalog.pg_class c on c.oid = i.inhrelid
+            where i.inhparent = %s::regclass
+        """
+        logging.debug(query)
+        return [partition[0] for partition in self._select_all(query, (clz._table_name,))]
+
+    def _get_range_partitioning(self, clz):
+        self._check_table_exists_for_class(clz)
+        if not isinstance(clz._table_partitioning, RangePartitioning):
+            raise Exception(f'Class {clz.__name__} is not range partitioned')
+        return clz._table_partitioning
+
+    def _create_index(self, clz, index):
+        query = index.create_query(clz)
+        logging.debug(query)
+        self._execute(query)
+        self._execute(f"comment on index {index.name(clz)} is '{MANAGED_INDEX_COMMENT}'")
+
+    def _update_indexes(self, clz):
+        indexes = {index.name(clz): index for index in get_class_indexes(clz)}
+        query = """
+            select c.relname, i.indisvalid, coalesce(obj_description(c.oid, 'pg_class') = %s, false)
+            from pg_catalog.pg_index i
+            join pg_catalog.pg_class c on c.oid = i.indexrelid
+            where i.indrelid = %s::regclass and (obj_description(c.oid, 'pg_class') = %s or c.relname = any(%s))
+        """
+        logging.debug(query)
+        rows = self._select_all(query, (MANAGED_INDEX_COMMENT, clz._table_name, MANAGED_INDEX_COMMENT, list(indexes)))
+        valid_indexes = set()
+        for index_name, valid, managed in rows:
+            if index_name in indexes and valid:
+                valid_indexes.add(index_name)
+                if not managed:
+                    self._execute(f"comment on index {index_name} is '{MANAGED_INDEX_COMMENT}'")
+                continue
+            # invalid leftovers of failed concurrent builds are rebuilt, commented or not
+            if clz._table_partitioning is not None:
+                self._execute(f'drop index if exists {index_name}')
+            else:
+                self._deferred_statements.append(f'drop index concurrently if exists {index_name}')
+        for index_name, index in indexes.items():
+            if index_name in valid_indexes:
+                continue
+            if clz._table_partitioning is not None:
+                self._create_index(clz, index)
+            else:
+                self._deferred_statements.append(index.create_query(clz, concurrently=True))
+                self._deferred_statements.append(
+                    f"comment on index {index_name} is '{MANAGED_INDEX_COMMENT}'")
+
+    def _execute_deferred_statements(self):
+        if not self._deferred_statements:
+            return
+        statements = self._deferred_statements
+        self._deferred_statements = []
+        self.connection.autocommit = True
+        try:
+            for query in statements:
+                logging.debug(query)
+                self._execute(query)
+        finally:
+            self.connection.autocommit = False
 
     def _update_class(self, clz):
-        field_names = set([field.name for field in get_class_database_fields(clz)])
+        field_names = {get_column_name(field): field.name for field in get_class_database_fields(clz)}
         actual_field_names = set([field[1] for field in self.db_table_structure(clz._table_name)])
         field_names_to_add = []
         field_names_to_drop = []
-        for field_name in field_names:
-            if not field_name in actual_field_names:
+        for column_name, field_name in field_names.items():
+            if not column_name in actual_field_names:
                 field_names_to_add.append(field_name)
+        link_names = set([relation.back_reference for relation in get_mapped_relations(clz)])
         for field_name in actual_field_names:
-            if not field_name in field_names:
+            if not field_name in field_names and not field_name in link_names:
                 field_names_to_drop.append(field_name)
         self._add_columns(clz, field_names_to_add)
         self._drop_columns(clz, field_names_to_drop)
+        if field_names_to_add or field_names_to_drop:
+            self._invalidate_class(clz)
+        self._update_indexes(clz)
 
     def _add_columns(self, clz, field_names):
         if not field_names:
@@ -288,14 +1287,105 @@ class Py2SQL:
         self._delete_object(obj)
 
     def _delete_object(self, obj):
-        self._check_table_exists_for_class(obj.__class__)
         clz = obj.__class__
+        self._delete_keys(clz, [getattr(obj, get_primary_key(clz).name)])
+
+    @transactional
+    def delete_objects(self, objects, cascade=False):
+        """
+        Delete objects from database in chunks of set-based deletes per class
+        :param objects: iterable of objects to delete
+        :param cascade: delete objects of many relations as well,
+        objects linked by back reference are deleted on server without loading them,
+        join table links are always deleted
+        :return: number of deleted records
+        """
+        return self._delete_objects(objects, cascade)
+
+    def _delete_objects(self, objects, cascade):
+        keys_by_class = {}
+        children = []
+        for obj in objects:
+            clz = obj.__class__
+            self._check_is_table(clz)
+            keys_by_class.setdefault(clz, []).append(getattr(obj, get_primary_key(clz).name))
+            if cascade:
+                for relation in get_many_relations(clz):
+                    if not relation.is_linked and relation.is_loaded(obj):
+                        children += getattr(obj, relation.name)
+        count = self._delete_objects(children, cascade) if children else 0
+        for clz, keys in keys_by_class.items():
+            count += self._delete_keys(clz, keys, cascade)
+        return count
+
+    def _delete_keys(self, clz, keys, cascade=False):
+        self._check_table_exists_for_class(clz)
         primary_key = get_primary_key(clz)
         query = f"""
-            delete from {clz._table_name} where id = {getattr(obj, primary_key.name)}
+            delete from {clz._table_name} where {get_column_name(primary_key)} = any(%s)
         """
         logging.debug(query)
-        self._execute(query)
+        count = 0
+        for chunk in chunks(keys, self._DELETE_CHUNK_SIZE):
+            if cascade:
+                count += self._delete_linked(clz, self._mogrify(
+                    f'select unnest(%s::{primary_key.column_type}[])', (chunk,)))
+            count += self._execute(query, (chunk,))
+            for key in chunk:
+                self._invalidate_object(clz, key)
+        return count
+
+    def _delete_linked(self, clz, keys_query, path=()):
+        count = 0
+        for relation in get_many_relations(clz):
+            mapping_class = relation.mapping_class
+            if not relation.back_reference or mapping_class in path:
+                continue
+            self._check_table_exists_for_class(mapping_class)
+            mapping_keys_query = f"""
+                select {get_column_name(get_primary_key(mapping_class))} from {mapping_class._table_name}
+                where {relation.back_reference} in ({keys_query})
+            """
+            count += self._delete_linked(mapping_class, mapping_keys_query, path + (clz,))
+            query = f"""
+                delete from {mapping_class._table_name} where {relation.back_reference} in ({keys_query})
+            """
+            logging.debug(query)
+            deleted = self._execute(query)
+            if deleted:
+                self._invalidate_class(mapping_class)
+            count += deleted
+        return count
+
+    @transactional
+    def delete_where(self, clz, where, params=None, cascade=False):
+        """
+        Delete all records of class matching condition by a single statement
+        :param clz: table class
+        :param where: condition, e.g. City.id.in_(ids), or SQL condition, e.g. 'capital and name like %s'
+        :param params: SQL condition query parameters
+        :param cascade: delete objects linked by back reference as well
+        :return: number of deleted records
+        """
+        return self._delete_where(clz, where, params, cascade)
+
+    def _delete_where(self, clz, where, params, cascade=False):
+        self._check_table_exists_for_class(clz)
+        where, params = self._get_where(clz, where, params)
+        count = 0
+        if cascade:
+            keys_query = f"""
+                select {get_column_name(get_primary_key(clz))} from {clz._table_name} where {where}
+            """
+            count += self._delete_linked(clz, self._mogrify(keys_query, params))
+        query = f"""
+            delete from {clz._table_name} where {where}
+        """
+        logging.debug(query)
+        deleted = self._execute(query, params)
+        if deleted:
+            self._invalidate_class(clz)
+        return count + deleted
 
     @transactional
     def delete_class(self, clz):
@@ -306,17 +1396,36 @@ class Py2SQL:
         self._delete_class(clz)
 
     def _delete_class(self, clz):
+        self._known_tables = None
         self._check_is_table(clz)
+        relations = [relation for relation in get_many_relations(clz) if relation.is_linked]
+        for relation in relations + get_mapped_relations(clz):
+            if relation.join_table:
+                query = f"""
+                    drop table if exists {relation.join_table}
+                """
+            elif relation.owner is clz and relation.mapping_class is not clz:
+                mapping_table = relation.mapping_class._table_name
+                query = f"""
+                    alter table if exists {mapping_table}
+                    drop constraint if exists {mapping_table}_{relation.back_reference}_fkey
+                """
+            else:
+                continue
+            logging.debug(query)
+            self._execute(query)
         query = f"""
             drop table if exists {clz._table_name} 
         """
         logging.debug(query)
         self._execute(query)
+        self._invalidate_class(clz)
 
     @transactional
     def delete_hierarchy(self, root_class):
         """
-        Delete class and child classes from database if they exist else raise exception
+        Delete class and child classes from database if they exist else raise exception.
+        Mapping classes of linked many relations are deleted as well
         :param root_class: root class to start deletion
         """
         self._delete_hierarchy(root_class)
@@ -328,29 +1437,155 @@ class Py2SQL:
         self._delete_class(clz)
         for refererenced_table in refererenced_tables:
             self._delete_hierarchy(refererenced_table.mapping_class)
+        for relation in get_many_relations(clz):
+            if relation.is_linked and relation.mapping_class is not clz:
+                self._delete_hierarchy(relation.mapping_class)
 
-    def _select_all(self, query):
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            values = cursor.fetchall()
-        return values
+    def _invalidate_object(self, clz, key):
+        if self.cache is not None:
+            self.cache.invalidate(clz._table_name, key)
+        if self.notify_channel is not None:
+            keys = self._pending_notifications.setdefault(clz._table_name, set())
+            if keys is not None:
+                keys.add(key)
 
-    def _select_single(self, query):
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            value = cursor.fetchone()[0]
-        return value
+    def _invalidate_class(self, clz):
+        if self.cache is not None:
+            self.cache.invalidate_table(clz._table_name)
+        if self.notify_channel is not None:
+            self._pending_notifications[clz._table_name] = None
+
+    def _flush_notifications(self):
+        if not self._pending_notifications:
+            return
+        for payload in build_payloads(self._pending_notifications):
+            logging.debug(f'Notify {self.notify_channel}: {payload}')
+            self._queue('select pg_notify(%s, %s)', (self.notify_channel, payload))
+        self._pending_notifications.clear()
+
+    def _queue(self, query, params=None, obj=None, fetch=None):
+        """
+        Execute statement or queue it if pipeline is enabled.
+        Statement with fetch callback completes the batch, callback gets fetched rows
+        """
+        if self._pipeline is None:
+            if fetch is None:
+                self._execute(query, params)
+            else:
+                fetch(self._select_all(query, params))
+            return
+        self._pipeline.append((self._mogrify(query, params), obj))
+        if fetch is not None:
+            fetch(self._flush_pipeline(fetch=True))
 
-    def _execute(self, query):
+    def _flush_pipeline(self, fetch=False):
+        if not self._pipeline:
+            return None
+        statements = self._pipeline
+        self._pipeline = []
+        batch = [f'savepoint {self._PIPELINE_SAVEPOINT}'] + [statement for statement, _ in statements]
+        if not fetch:
+            batch.append(f'release savepoint {self._PIPELINE_SAVEPOINT}')
         with self.connection.cursor() as cursor:
-            cursor.execute(query)
+            try:
+                cursor.execute(';\n'.join(batch))
+            except psycopg2.Error:
+                cursor.execute(f'rollback to savepoint {self._PIPELINE_SAVEPOINT}')
+                self._replay_pipeline(cursor, statements)
+                raise
+            if not fetch:
+                return None
+            # rows of the last statement are fetched before the savepoint is released
+            rows = cursor.fetchall()
+            cursor.execute(f'release savepoint {self._PIPELINE_SAVEPOINT}')
+        return rows
 
     @staticmethod
-    def _size_kb_to_mb(size):
-        return float(size.split(' ')[0]) / 1000
+    def _replay_pipeline(cursor, statements):
+        for statement, obj in statements:
+            try:
+                cursor.execute(statement)
+            except psycopg2.Error as exc:
+                if obj is None:
+                    raise exc
+                key = getattr(obj, get_primary_key(obj.__class__).name)
+                raise Exception(f'Failed to save {obj.__class__.__name__} {key}: {exc}'.strip()) from exc
+
+    def _select_all(self, query, params=None):
+        return self._select(query, params, lambda cursor: cursor.fetchall())
+
+    def _select_single(self, query, params=None):
+        return self._select(query, params, lambda cursor: cursor.fetchone()[0])
+
+    def _select(self, query, params, fetch, prepare=False):
+        def select(cursor):
+            self._execute_select(cursor, query, params, prepare)
+            return fetch(cursor)
+
+        return self._read(select)
+
+    def _read(self, read):
+        self._flush_pipeline()
+        self._read_from_replica = False
+        connection = self._get_read_connection()
+        if connection is not None:
+            started = time.monotonic()
+            try:
+                with connection.cursor() as cursor:
+                    values = read(cursor)
+                self._replicas.record(connection, time.monotonic() - started)
+                self._read_from_replica = True
+                return values
+            except psycopg2.OperationalError as exc:
+                logging.warning(f'Replica query failed, falling back to primary: {exc}')
+                self._replicas.fail(connection)
+        # read outside of transaction ends its implicit transaction, so read tables are not kept locked
+        is_implicit = not self._in_transaction and \
+            self.connection.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        try:
+            with self.connection.cursor() as cursor:
+                return read(cursor)
+        finally:
+            if is_implicit:
+                self.connection.rollback()
+
+    def _execute_select(self, cursor, query, params, prepare):
+        if not prepare:
+            cursor.execute(query, params)
+            return
+        prepared_query, params_count = to_prepared_query(query)
+        statements = self._prepared.setdefault(cursor.connection, {})
+        name = statements.get(query)
+        if name is None:
+            if len(statements) >= self._PREPARED_LIMIT:
+                cursor.execute(f'deallocate {statements.pop(next(iter(statements)))}')
+            name = f'py2sqlm_{next(self._prepared_names)}'
+            prepare_query = f'prepare {name} as {prepared_query}'
+            logging.debug(prepare_query)
+            cursor.execute(prepare_query)
+            statements[query] = name
+        arguments = f" ({', '.join(['%s'] * params_count)})" if params_count else ''
+        cursor.execute(f'execute {name}{arguments}', params)
+
+    def _get_read_connection(self):
+        if self._replicas is None or self._in_transaction or time.monotonic() < self._sticky_until:
+            return None
+        return self._replicas.choose()
+
+    def _execute(self, query, params=None):
+        self._flush_pipeline()
+        with self.connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.rowcount
+
+    def _mogrify(self, query, params=None):
+        with self.connection.cursor() as cursor:
+            return cursor.mogrify(query, params).decode()
 
     def _check_table_exists(self, name):
-        if name not in self.db_tables:
+        if self._known_tables is None or name not in self._known_tables:
+            self._known_tables = set(self.db_tables)
+        if name not in self._known_tables:
             raise Exception(f'Table {name} does not exist in schema public')
 
     @staticmethod
@@ -361,17 +1596,3 @@ class Py2SQL:
     def _check_table_exists_for_class(self, clz):
         self._check_is_table(clz)
         self._check_table_exists(clz._table_name)
-
-    @staticmethod
-    def _format_field(value):
-        if isinstance(value, str):
-            return f"'{value}'"
-        if value == None:
-            return 'null'
-        if JsonbField.is_type_supported(value):
-            if isinstance(value, set) or isinstance(value, frozenset):
-                value = list(value)
-            if isinstance(value, ArrayType):
-                value = value.tolist()
-            return f"'{json.dumps(value)}'"
-        return str(value)
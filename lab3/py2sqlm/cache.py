@@ -0,0 +1,127 @@
+import time
+import threading
+from collections import OrderedDict
+from py2sqlm.fields import get_primary_key
+
+
+class ObjectCache:
+    """
+    In-process LRU cache of loaded objects.
+    Objects are keyed by table name and primary key value,
+    so that a row is evicted whichever class it is written through.
+    Entries expire after ttl seconds if ttl is specified.
+    Cache is thread safe, so it can be invalidated by a background listener.
+    Invalidation changes table generation, objects read before it are not cached
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        """
+        Construct object cache
+        :param max_size: maximum number of cached objects
+        :param ttl: entry time to live in seconds (default - no expiration)
+        """
+        if not isinstance(max_size, int) or max_size < 1:
+            raise Exception(f'Invalid max_size: {max_size}')
+        if ttl is not None and ttl <= 0:
+            raise Exception(f'Invalid ttl: {ttl}')
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._clears = 0
+        self._lock = threading.Lock()
+
+    def get(self, clz, key):
+        """
+        Return cached object or None if it is absent or expired
+        :param clz: table class
+        :param key: primary key value
+        """
+        cache_key = (clz._table_name, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                self.misses += 1
+                return None
+            obj, expires_at = entry
+            if not isinstance(obj, clz) or (expires_at is not None and expires_at <= time.monotonic()):
+                del self._entries[cache_key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return obj
+
+    def generation(self, table_name):
+        """
+        Return table generation, it changes whenever objects of table are invalidated
+        :param table_name: table name
+        """
+        with self._lock:
+            return self._clears, self._generations.get(table_name, 0)
+
+    def put(self, obj, generation=None):
+        """
+        Put object to cache evicting the least recently used one if cache is full
+        :param obj: object of table class
+        :param generation: table generation read before object was queried,
+        object is not cached if table was invalidated since then
+        """
+        clz = obj.__class__
+        cache_key = (clz._table_name, getattr(obj, get_primary_key(clz).name))
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and generation != (self._clears, self._generations.get(clz._table_name, 0)):
+                return
+            self._entries[cache_key] = (obj, expires_at)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, table_name, key):
+        """
+        Remove cached object
+        :param table_name: table name
+        :param key: primary key value
+        """
+        with self._lock:
+            self._entries.pop((table_name, key), None)
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+
+    def invalidate_table(self, table_name):
+        """
+        Remove all cached objects of table
+        :param table_name: table name
+        """
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._entries if cache_key[0] == table_name]:
+                del self._entries[cache_key]
+            self._generations[table_name] = self._generations.get(table_name, 0) + 1
+
+    def clear(self):
+        """
+        Remove all cached objects
+        """
+        with self._lock:
+            self._entries.clear()
+            self._clears += 1
+
+    @property
+    def stats(self):
+        """
+        :return: dict of hits, misses, evictions and current size
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries)
+        }
+
+    def __len__(self):
+        return len(self._entries)
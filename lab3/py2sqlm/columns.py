@@ -0,0 +1,293 @@
+import struct
+from array import array
+from py2sqlm.fields import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+_HEADER = struct.Struct('>11sii')
+_FIELD_COUNT = struct.Struct('>h')
+_FIELD_LENGTH = struct.Struct('>i')
+
+
+class ColumnType:
+    """
+    Binary column type: struct format, wire and result NumPy dtypes and array typecode
+    """
+
+    def __init__(self, format, wire_dtype, dtype, typecode, null):
+        self.format = format
+        self.struct = struct.Struct('>' + format)
+        self.width = self.struct.size
+        self.wire_dtype = wire_dtype
+        self.dtype = dtype
+        self.typecode = typecode
+        self.null = null
+
+
+_INT = ColumnType('q', '>i8', 'int64', 'q', None)
+_FLOAT = ColumnType('f', '>f4', 'float32', 'f', float('nan'))
+_BOOL = ColumnType('?', '?', 'bool', 'b', None)
+
+
+def get_column_type(field):
+    """
+    :param field: database field
+    :return: binary column type of field
+    """
+    if isinstance(field, ForeignKey):
+        field = get_primary_key(field.mapping_class)
+    if isinstance(field, IntField):
+        return _INT
+    if isinstance(field, FloatField):
+        return _FLOAT
+    if isinstance(field, BoolField):
+        return _BOOL
+    raise Exception(f'Field {field.name} can not be loaded as column, only int, float and bool fields are supported')
+
+
+def get_select_column(field):
+    """
+    :param field: database field
+    :return: select expression of field column.
+    Nulls of float column are replaced with NaN by server, so rows stay fixed width and are decoded in bulk
+    """
+    column = get_column_name(field)
+    if get_column_type(field) is _FLOAT:
+        return f"coalesce({column}, 'NaN')"
+    return column
+
+
+class ColumnBuffer:
+    """
+    Growing column of values.
+    Values are written into preallocated NumPy array or array.array, when NumPy is absent,
+    which grows by chunks
+    """
+
+    def __init__(self, column_type, chunk_size):
+        self.column_type = column_type
+        self.chunk_size = chunk_size
+        self.size = 0
+        if numpy is not None:
+            self.values = numpy.empty(chunk_size, dtype=column_type.dtype)
+        else:
+            self.values = array(column_type.typecode, [0]) * chunk_size
+
+    def extend(self, values):
+        """
+        Append NumPy array of values
+        """
+        count = len(values)
+        self.reserve(count)
+        self.values[self.size:self.size + count] = values
+        self.size += count
+
+    def append(self, value):
+        """
+        Append single value
+        """
+        if self.size == len(self.values):
+            self.reserve(1)
+        self.values[self.size] = value
+        self.size += 1
+
+    def reserve(self, count):
+        """
+        Grow values, so that count more values can be written after size
+        """
+        if self.size + count <= len(self.values):
+            return
+        capacity = len(self.values)
+        while capacity < self.size + count:
+            capacity += max(capacity, self.chunk_size)
+        if numpy is not None:
+            self.values.resize(capacity, refcheck=False)
+        else:
+            self.values.extend(array(self.column_type.typecode, [0]) * (capacity - len(self.values)))
+
+    def result(self):
+        """
+        :return: NumPy array or array.array of appended values
+        """
+        if numpy is not None:
+            self.values.resize(self.size, refcheck=False)
+        else:
+            del self.values[self.size:]
+        return self.values
+
+
+class BinaryCopyReader:
+    """
+    File-like object parsing COPY binary format into column buffers.
+    Fixed width rows without nulls are decoded in bulk with NumPy.
+    When nulls are too frequent for bulk decoding to pay off, rows are decoded one by one
+    for a while before bulk decoding is tried again
+    """
+
+    _PARSE_SIZE = 1024 * 1024
+    _MIN_WINDOW = 64
+    _SCALAR_ROWS = 4096
+
+    def __init__(self, fields, chunk_size=65536):
+        """
+        Construct reader
+        :param fields: selected database fields
+        :param chunk_size: column buffer growth step
+        """
+        self.fields = fields
+        self.column_types = [get_column_type(field) for field in fields]
+        self.buffers = [ColumnBuffer(column_type, chunk_size) for column_type in self.column_types]
+        self._data = bytearray()
+        self._offset = 0
+        self._window = self._MIN_WINDOW
+        self._scalar_rows = 0
+        self._header_read = False
+        self._finished = False
+        self._row = struct.Struct('>h' + ''.join(['i' + column_type.format for column_type in self.column_types]))
+        self._row_widths = tuple([column_type.width for column_type in self.column_types])
+        self._min_row_size = _FIELD_COUNT.size + _FIELD_LENGTH.size * len(self.column_types)
+        if numpy is not None:
+            dtype = [('count', '>i2')]
+            for i, column_type in enumerate(self.column_types):
+                dtype += [(f'length{i}', '>i4'), (f'value{i}', column_type.wire_dtype)]
+            self._row_dtype = numpy.dtype(dtype)
+
+    def write(self, data):
+        """
+        Consume next portion of COPY output.
+        COPY writes row by row, so data is parsed when enough of it is buffered
+        """
+        self._data += data
+        if len(self._data) >= self._PARSE_SIZE:
+            self._parse()
+
+    def result(self):
+        """
+        :return: dict of field name to array of values
+        """
+        self._parse()
+        if not self._finished:
+            raise Exception('COPY data is incomplete')
+        return {field.name: buffer.result() for field, buffer in zip(self.fields, self.buffers)}
+
+    def _parse(self):
+        if not self._header_read and not self._read_header():
+            return
+        while not self._finished:
+            if numpy is not None and self._scalar_rows <= 0:
+                consumed = self._read_rows()
+            else:
+                consumed = self._read_rows_with_struct()
+            if not consumed and not self._read_row():
+                break
+            self._scalar_rows -= max(consumed, 1)
+        del self._data[:self._offset]
+        self._offset = 0
+
+    def _read_header(self):
+        if len(self._data) < _HEADER.size:
+            return False
+        signature, flags, extension_length = _HEADER.unpack_from(self._data)
+        if signature != _SIGNATURE:
+            raise Exception('Invalid COPY binary signature')
+        if len(self._data) < _HEADER.size + extension_length:
+            return False
+        self._offset = _HEADER.size + extension_length
+        self._header_read = True
+        return True
+
+    def _read_rows(self):
+        if numpy is None:
+            return self._read_rows_with_struct()
+        count = min((len(self._data) - self._offset) // self._row_dtype.itemsize, self._window)
+        if not count:
+            return 0
+        rows = numpy.frombuffer(self._data, dtype=self._row_dtype, count=count, offset=self._offset)
+        valid = rows['count'] == len(self.column_types)
+        for i, column_type in enumerate(self.column_types):
+            valid &= rows[f'length{i}'] == column_type.width
+        if valid.all():
+            self._window *= 2
+        else:
+            count = int(numpy.argmin(valid))
+            rows = rows[:count]
+            if count < self._MIN_WINDOW:
+                # nulls are frequent, window is kept for the next bulk attempt
+                self._scalar_rows = self._SCALAR_ROWS
+            else:
+                self._window = max(2 * count, self._MIN_WINDOW)
+        for i, buffer in enumerate(self.buffers):
+            buffer.extend(rows[f'value{i}'])
+        self._offset += count * self._row_dtype.itemsize
+        return count
+
+    def _read_rows_with_struct(self):
+        data = self._data
+        offset = self._offset
+        rows = (len(data) - offset) // self._min_row_size
+        if numpy is not None:
+            rows = min(rows, self._scalar_rows)
+        for buffer in self.buffers:
+            buffer.reserve(rows)
+        columns = [buffer.values for buffer in self.buffers]
+        position = self.buffers[0].size
+        row = self._row
+        column_count = len(self.column_types)
+        last_offset = len(data) - row.size
+        count = 0
+        while count < rows:
+            values = row.unpack_from(data, offset) if offset <= last_offset else None
+            if values is not None and values[0] == column_count and values[1::2] == self._row_widths:
+                values = values[2::2]
+                offset += row.size
+            else:
+                row_values = self._decode_row(offset)
+                if row_values is None:
+                    break
+                values, offset = row_values
+            for column, value in zip(columns, values):
+                column[position + count] = value
+            count += 1
+        for buffer in self.buffers:
+            buffer.size += count
+        self._offset = offset
+        return count
+
+    def _read_row(self):
+        if len(self._data) - self._offset < _FIELD_COUNT.size:
+            return False
+        if _FIELD_COUNT.unpack_from(self._data, self._offset)[0] == -1:
+            self._finished = True
+            return True
+        row_values = self._decode_row(self._offset)
+        if row_values is None:
+            return False
+        values, self._offset = row_values
+        for buffer, value in zip(self.buffers, values):
+            buffer.append(value)
+        return True
+
+    def _decode_row(self, offset):
+        if len(self._data) < offset + _FIELD_COUNT.size or _FIELD_COUNT.unpack_from(self._data, offset)[0] == -1:
+            return None
+        offset += _FIELD_COUNT.size
+        values = []
+        for column_type in self.column_types:
+            if len(self._data) < offset + _FIELD_LENGTH.size:
+                return None
+            length = _FIELD_LENGTH.unpack_from(self._data, offset)[0]
+            offset += _FIELD_LENGTH.size
+            if length == -1:
+                if column_type.null is None:
+                    raise Exception(f'Null value can not be loaded into {column_type.dtype} column')
+                values.append(column_type.null)
+                continue
+            if len(self._data) < offset + length:
+                return None
+            values.append(column_type.struct.unpack_from(self._data, offset)[0])
+            offset += length
+        return values, offset
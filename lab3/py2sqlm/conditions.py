@@ -0,0 +1,107 @@
+class Comparable:
+    """
+    Comparison operators of database field descriptors.
+    Comparing field accessed on class builds query condition, e.g. City.capital == True
+    """
+
+    __hash__ = object.__hash__
+
+    def __eq__(self, value):
+        return Comparison(self, '=', value)
+
+    def __ne__(self, value):
+        return Comparison(self, '<>', value)
+
+    def __lt__(self, value):
+        return Comparison(self, '<', value)
+
+    def __le__(self, value):
+        return Comparison(self, '<=', value)
+
+    def __gt__(self, value):
+        return Comparison(self, '>', value)
+
+    def __ge__(self, value):
+        return Comparison(self, '>=', value)
+
+    def in_(self, values):
+        """
+        :param values: iterable of values
+        :return: condition matching any of values
+        """
+        return In(self, list(values))
+
+
+class Condition:
+    """
+    Query condition.
+    Conditions are combined with & (and), | (or) and ~ (not)
+    """
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def __bool__(self):
+        raise Exception('Condition can not be used as boolean, combine conditions with &, | and ~')
+
+
+class Comparison(Condition):
+    """
+    Comparison of field with value or another field
+    """
+
+    def __init__(self, field, operator, value):
+        self.field = field
+        self.operator = operator
+        self.value = value
+
+    def __bool__(self):
+        """
+        Fields are equal only to themselves, so fields can be found in lists and dicts
+        """
+        if isinstance(self.value, Comparable) and self.operator in ('=', '<>'):
+            return (self.field is self.value) == (self.operator == '=')
+        return super().__bool__()
+
+
+class In(Condition):
+    """
+    Field value is one of values
+    """
+
+    def __init__(self, field, values):
+        self.field = field
+        self.values = values
+
+
+class And(Condition):
+    """
+    All of conditions
+    """
+
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+
+class Or(Condition):
+    """
+    Any of conditions
+    """
+
+    def __init__(self, *conditions):
+        self.conditions = conditions
+
+
+class Not(Condition):
+    """
+    Negated condition
+    """
+
+    def __init__(self, condition):
+        self.condition = condition
@@ -1,21 +1,33 @@
 import inspect
+import weakref
 from array import ArrayType
+from datetime import datetime
 from abc import ABCMeta, abstractmethod
+from py2sqlm.conditions import Comparable
 
+_deferred_loaders = weakref.WeakKeyDictionary()
 
-class DatabaseField(metaclass=ABCMeta):
+
+class DatabaseField(Comparable, metaclass=ABCMeta):
     """
-    Database field descriptor
+    Database field descriptor.
+    Comparing descriptor accessed on class builds query condition, e.g. City.capital == True
     """
 
-    def __init__(self, column_name=None, primary_key=False):
+    def __init__(self, column_name=None, primary_key=False, index=False, unique=False, deferred=False):
         """
         Construct database field
         :param column_name: table column name
         :param primary_key: is column a primary key
+        :param index: create index on column
+        :param unique: create unique index on column
+        :param deferred: do not load column by default, it is fetched on first access
         """
         self.column_name = column_name
         self.primary_key = primary_key
+        self.index = index
+        self.unique = unique
+        self.deferred = deferred
 
     def __set__(self, instance, value):
         """
@@ -27,10 +39,21 @@ class DatabaseField(metaclass=ABCMeta):
 
     def __get__(self, instance, owner):
         """
-        Return database field value
+        Return database field value or field itself if accessed on class.
+        Deferred value of loaded object is fetched on first access
         """
+        if instance is None:
+            return self
+        if not self.is_loaded(instance):
+            _load_deferred(instance, self)
         return instance.__dict__['_' + self.name]
 
+    def is_loaded(self, instance):
+        """
+        Return True if field value is set or loaded
+        """
+        return '_' + self.name in instance.__dict__
+
     def __set_name__(self, owner, name):
         """
         Set attribute name
@@ -71,12 +94,69 @@ class DatabaseField(metaclass=ABCMeta):
             raise Exception(f'Primary key should have a boolean value')
         self._primary_key = value
 
+    @property
+    def index(self):
+        """
+        Return True if column should be indexed
+        """
+        return self._index
+
+    @index.setter
+    def index(self, value):
+        """
+        Set index flag
+        """
+        if not isinstance(value, bool):
+            raise Exception(f'Index should have a boolean value')
+        self._index = value
+
+    @property
+    def unique(self):
+        """
+        Return True if column values should be unique
+        """
+        return self._unique
+
+    @unique.setter
+    def unique(self, value):
+        """
+        Set unique flag
+        """
+        if not isinstance(value, bool):
+            raise Exception(f'Unique should have a boolean value')
+        self._unique = value
+
+    @property
+    def deferred(self):
+        """
+        Return True if column is not loaded by default
+        """
+        return self._deferred
+
+    @deferred.setter
+    def deferred(self, value):
+        """
+        Set deferred flag
+        """
+        if not isinstance(value, bool):
+            raise Exception(f'Deferred should have a boolean value')
+        if value and (self.primary_key or isinstance(self, ForeignKey)):
+            raise Exception(f'Primary key and foreign key can not be deferred')
+        self._deferred = value
+
+    @property
+    def column_definition(self):
+        """
+        SQL type definition without constraints property
+        """
+        return f'{self.column_name} {self.column_type}'
+
     @property
     def definition(self):
         """
         SQL type definition property
         """
-        definition = f'{self.column_name} {self.column_type}'
+        definition = self.column_definition
         if self.primary_key:
             definition += ' primary key'
         return definition
@@ -136,6 +216,19 @@ class BoolField(DatabaseField):
         return isinstance(value, bool)
 
 
+class DateTimeField(DatabaseField):
+    """
+    Date and time database field descriptor
+    """
+
+    @property
+    def column_type(self):
+        return 'timestamp'
+
+    def is_valid_value(self, value):
+        return isinstance(value, datetime)
+
+
 class TextField(DatabaseField):
     """
     Text database field descriptor.
@@ -190,6 +283,20 @@ class JsonbField(DatabaseField):
 
     valid_types = {list, tuple, dict, set, frozenset, ArrayType}
 
+    def __init__(self, gin=False, gin_path_ops=False, **kwargs):
+        """
+        Construct jsonb database field
+        :param gin: create GIN index supporting all jsonb operators
+        :param gin_path_ops: create smaller and faster GIN index with jsonb_path_ops,
+        which supports only containment (@>) and jsonpath operators
+        :param kwargs: database field parameters
+        """
+        super().__init__(**kwargs)
+        if not isinstance(gin, bool) or not isinstance(gin_path_ops, bool):
+            raise Exception(f'GIN flags should have boolean values')
+        self.gin = gin
+        self.gin_path_ops = gin_path_ops
+
     @staticmethod
     def is_type_supported(type):
         """
@@ -283,14 +390,30 @@ class ForeignKey(DatabaseField):
 class ManyRelation:
     """
     Many relation descriptor.
-    Used to map one-to-many or many-to-many relations
+    Used to map one-to-many or many-to-many relations.
+    Links are stored either in a back reference column of mapping class table (one-to-many)
+    or in a join table (many-to-many), otherwise they are not stored at all
     """
-    def __init__(self, mapping_class):
+
+    _linked_relations = {}
+
+    def __init__(self, mapping_class, back_reference=None, join_table=None):
         """
         Construct many relation descriptor
         :param mapping_class: objects to map class
-        """
+        :param back_reference: True or column name of mapping class table referencing owner
+        (default name - owner table name plus '_id')
+        :param join_table: True or name of join table
+        (default name - owner table name plus '_' plus attribute name)
+        """
+        if back_reference and join_table:
+            raise Exception('Relation can have either back reference or join table')
+        for value in (back_reference, join_table):
+            if value is not None and not isinstance(value, (bool, str)):
+                raise Exception(f'Invalid relation link: {value}')
         self.mapping_class = mapping_class
+        self._back_reference = back_reference
+        self._join_table = join_table
 
     def __set__(self, instance, value):
         """
@@ -304,8 +427,13 @@ class ManyRelation:
 
     def __get__(self, instance, owner):
         """
-        Return list of referencing objects
+        Return list of referencing objects or relation itself if accessed on class.
+        Stored links of loaded object are fetched on first access
         """
+        if instance is None:
+            return self
+        if not self.is_loaded(instance):
+            _load_deferred(instance, self)
         return instance.__dict__['_' + self.name]
 
     def __set_name__(self, owner, name):
@@ -313,6 +441,59 @@ class ManyRelation:
         Set attribute name
         """
         self.name = name
+        self.owner = owner
+
+    def is_loaded(self, instance):
+        """
+        Return True if list of referencing objects is set or loaded
+        """
+        return '_' + self.name in instance.__dict__
+
+    @property
+    def is_linked(self):
+        """
+        Return True if links are stored in database
+        """
+        return bool(self._back_reference or self._join_table)
+
+    @property
+    def back_reference(self):
+        """
+        Back reference column name or None
+        """
+        if not self._back_reference:
+            return None
+        if isinstance(self._back_reference, str):
+            return self._back_reference
+        return self.owner._table_name + '_id'
+
+    @property
+    def join_table(self):
+        """
+        Join table name or None
+        """
+        if not self._join_table:
+            return None
+        if isinstance(self._join_table, str):
+            return self._join_table
+        return f'{self.owner._table_name}_{self.name}'
+
+    @property
+    def owner_column(self):
+        """
+        Join table column referencing owner
+        """
+        return self.owner._table_name + '_id'
+
+    @property
+    def mapping_column(self):
+        """
+        Join table column referencing mapping class
+        """
+        column = self.mapping_class._table_name + '_id'
+        if column == self.owner_column:
+            return self.name + '_id'
+        return column
 
     @property
     def mapping_class(self):
@@ -367,3 +548,69 @@ def get_primary_key(clz):
     if len(primary_keys) != 1:
         raise Exception('Table should have exactly one primary key')
     return primary_keys[0]
+
+
+def get_column_name(field):
+    """
+    Helper method to get table column name of database field
+    :param field: database field
+    :return: table column name
+    """
+    if isinstance(field, ForeignKey):
+        return field.mapping_column
+    return field.name
+
+
+def get_many_relations(clz):
+    """
+    Helper method to get all many relations of class
+    :param clz: table class
+    :return: list of many relation descriptors
+    """
+    return list(filter(lambda field: isinstance(field, ManyRelation), clz.__dict__.values()))
+
+
+def register_linked_relations(clz):
+    """
+    Helper method to register linked many relations of table class.
+    Relations registered for the same table name before are replaced.
+    Back reference column should not be mapped by a field of mapping class
+    :param clz: table class
+    """
+    relations = [relation for relation in get_many_relations(clz) if relation.is_linked]
+    for relation in relations:
+        column = relation.back_reference
+        if column and column in [get_column_name(field) for field in get_class_database_fields(relation.mapping_class)]:
+            raise Exception(f'Back reference {column} of {clz.__name__}.{relation.name} '
+                            f'collides with column of {relation.mapping_class.__name__}')
+    if relations:
+        ManyRelation._linked_relations[clz._table_name] = relations
+    else:
+        ManyRelation._linked_relations.pop(clz._table_name, None)
+
+
+def get_mapped_relations(clz):
+    """
+    Helper method to get linked many relations of table classes mapping objects of class
+    :param clz: table class
+    :return: list of many relation descriptors with back reference or join table
+    """
+    return [relation for relations in ManyRelation._linked_relations.values() for relation in relations
+            if getattr(relation.mapping_class, '_table_name', None) == clz._table_name]
+
+
+def set_deferred_loader(instance, loader):
+    """
+    Helper method to link partially loaded object to loader of its not loaded fields.
+    Link is kept outside of object, so object can be copied and pickled
+    :param instance: loaded object
+    :param loader: mapper method called with object and field or relation
+    """
+    _deferred_loaders[instance] = weakref.WeakMethod(loader)
+
+
+def _load_deferred(instance, field):
+    loader = _deferred_loaders.get(instance)
+    loader = loader() if loader is not None else None
+    if loader is not None:
+        loader(instance, field)
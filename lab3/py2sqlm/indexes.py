@@ -0,0 +1,103 @@
+import hashlib
+from py2sqlm.fields import *
+
+MANAGED_INDEX_COMMENT = 'py2sqlm'
+
+_MAX_IDENTIFIER_LENGTH = 63
+
+
+class Index:
+    """
+    Table index declaration.
+    Composite indexes are declared with @table(indexes=[...])
+    """
+
+    methods = {'btree', 'hash', 'gin', 'gist', 'brin'}
+
+    def __init__(self, *fields, unique=False, method='btree', operator_class=None):
+        """
+        Construct index
+        :param fields: indexed attribute names in index order
+        :param unique: is index unique
+        :param method: index access method
+        :param operator_class: operator class applied to every column, e.g. jsonb_path_ops
+        """
+        if not fields or not all(isinstance(field, str) for field in fields):
+            raise Exception(f'Index should have at least one field name')
+        if method not in self.methods:
+            raise Exception(f'Invalid index method: {method}')
+        if not isinstance(unique, bool):
+            raise Exception(f'Unique should have a boolean value')
+        self.fields = fields
+        self.unique = unique
+        self.method = method
+        self.operator_class = operator_class
+
+    def columns(self, clz):
+        """
+        :param clz: table class
+        :return: indexed column names
+        """
+        columns = []
+        for field_name in self.fields:
+            field = clz.__dict__.get(field_name)
+            if not isinstance(field, DatabaseField):
+                raise Exception(f'Index field {field_name} is not a database field of {clz.__name__}')
+            columns.append(get_column_name(field))
+        return columns
+
+    def name(self, clz):
+        """
+        :param clz: table class
+        :return: index name unique for table, columns and index kind
+        """
+        if self.unique:
+            suffix = 'key'
+        elif self.operator_class == 'jsonb_path_ops':
+            suffix = 'gin_path'
+        elif self.method != 'btree':
+            suffix = self.method
+        else:
+            suffix = 'idx'
+        name = f"{clz._table_name}_{'_'.join(self.columns(clz))}_{suffix}"
+        if len(name) > _MAX_IDENTIFIER_LENGTH:
+            digest = hashlib.md5(name.encode()).hexdigest()[:8]
+            name = f'{name[:_MAX_IDENTIFIER_LENGTH - 9]}_{digest}'
+        return name
+
+    def create_query(self, clz, concurrently=False):
+        """
+        :param clz: table class
+        :param concurrently: build index without locking writes
+        :return: create index query
+        """
+        operator_class = f' {self.operator_class}' if self.operator_class else ''
+        columns = ', '.join([f'{column}{operator_class}' for column in self.columns(clz)])
+        return f"""
+            create {'unique ' if self.unique else ''}index {'concurrently ' if concurrently else ''}if not exists
+            {self.name(clz)} on {clz._table_name} using {self.method} ({columns})
+        """
+
+
+def get_class_indexes(clz):
+    """
+    Helper method to get all declared indexes of class.
+    Includes field indexes and composite indexes declared in @table
+    :param clz: table class
+    :return: list of indexes
+    """
+    indexes = []
+    for field in get_class_database_fields(clz):
+        if field.primary_key:
+            continue
+        if field.unique:
+            indexes.append(Index(field.name, unique=True))
+        elif field.index:
+            indexes.append(Index(field.name))
+        if isinstance(field, JsonbField):
+            if field.gin:
+                indexes.append(Index(field.name, method='gin'))
+            if field.gin_path_ops:
+                indexes.append(Index(field.name, method='gin', operator_class='jsonb_path_ops'))
+    indexes += getattr(clz, '_table_indexes', [])
+    return indexes
@@ -0,0 +1,199 @@
+import io
+import os
+import json
+import time
+import logging
+import psycopg2
+from array import ArrayType
+from datetime import datetime
+from psycopg2.extras import Json, execute_values
+from py2sqlm.fields import *
+
+_worker_connection = None
+
+
+def get_object_row(obj):
+    """
+    Convert object to list of table column values.
+    Foreign keys are converted to referenced primary key values
+    :param obj: object of table class
+    :return: list of column values in get_class_database_fields order
+    """
+    row = []
+    for field in get_class_database_fields(obj.__class__):
+        value = getattr(obj, field.name)
+        if isinstance(field, ForeignKey) and value is not None:
+            value = getattr(value, get_primary_key(value.__class__).name)
+        row.append(value)
+    return row
+
+
+def to_csv_line(row):
+    """
+    Convert row to CSV line understood by COPY: NULL is an unquoted empty field
+    :param row: list of column values
+    :return: CSV line
+    """
+    return ','.join([_to_csv_field(value) for value in row]) + '\n'
+
+
+def _to_csv_field(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, datetime):
+        text = value.isoformat(sep=' ')
+    elif JsonbField.is_type_supported(value):
+        text = json.dumps(_to_json_value(value))
+    else:
+        text = str(value)
+    return '"' + text.replace('"', '""') + '"'
+
+
+def to_sql_row(row):
+    """
+    Adapt row values for query parameters, jsonb values are wrapped in Json
+    :param row: list of column values
+    :return: list of adapted values
+    """
+    return [Json(_to_json_value(value)) if JsonbField.is_type_supported(value) else value for value in row]
+
+
+def _to_json_value(value):
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, ArrayType):
+        return value.tolist()
+    return value
+
+
+def init_worker(config):
+    """
+    Worker process initializer, opens connection used by all shards of the worker
+    :param config: database connection config
+    """
+    global _worker_connection
+    _worker_connection = psycopg2.connect(**config)
+
+
+def load_shard(config, table_name, columns, shard, method, conflict_columns, retries):
+    """
+    Load shard in a single transaction, retrying on operational errors
+    :param config: database connection config
+    :param table_name: table name
+    :param columns: column names
+    :param shard: list of rows or CSV text for 'copy' method
+    :param method: 'copy' or 'insert'
+    :param conflict_columns: columns of conflict target to skip existing rows on insert
+    :param retries: number of retries
+    :return: number of loaded rows
+    """
+    global _worker_connection
+    for attempt in range(retries + 1):
+        try:
+            if _worker_connection is None or _worker_connection.closed:
+                _worker_connection = psycopg2.connect(**config)
+            with _worker_connection.cursor() as cursor:
+                if method == 'copy':
+                    text = shard if isinstance(shard, str) else ''.join([to_csv_line(row) for row in shard])
+                    cursor.copy_expert(f"copy {table_name} ({', '.join(columns)}) from stdin with (format csv)",
+                                       io.StringIO(text))
+                    count = cursor.rowcount
+                else:
+                    conflict = f"on conflict ({', '.join(conflict_columns)}) do nothing" if conflict_columns else ''
+                    execute_values(cursor, f"insert into {table_name} ({', '.join(columns)}) values %s {conflict}",
+                                   [to_sql_row(row) for row in shard], page_size=1000)
+                    count = len(shard)
+            _worker_connection.commit()
+            return count
+        except psycopg2.OperationalError as exc:
+            _rollback_worker_connection()
+            if attempt == retries:
+                raise exc
+            logging.warning(f'Shard of {table_name} failed ({exc}), retry {attempt + 1} of {retries}')
+            time.sleep(2 ** attempt * 0.1)
+        except Exception:
+            _rollback_worker_connection()
+            raise
+
+
+def _rollback_worker_connection():
+    if _worker_connection is not None and not _worker_connection.closed:
+        _worker_connection.rollback()
+
+
+class CsvRowsReader:
+    """
+    File-like object reading rows as CSV text for COPY without building the whole text
+    """
+
+    def __init__(self, rows):
+        """
+        Construct reader
+        :param rows: iterable of lists of column values
+        """
+        self._lines = map(to_csv_line, rows)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        """
+        Read at most size characters of CSV text
+        """
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        text, self._buffer = self._buffer[:size], self._buffer[size:]
+        return text
+
+
+def read_csv_shards(path, shard_size):
+    """
+    Read CSV file with header by shards of lines.
+    Every record should be a single line
+    :param path: CSV file path
+    :param shard_size: number of lines in shard
+    :return: tuple of column names and generator of CSV text shards
+    """
+    file = open(path, newline='')
+    columns = [column.strip() for column in file.readline().strip().split(',')]
+
+    def shards():
+        with file:
+            lines = []
+            for line in file:
+                lines.append(line)
+                if len(lines) == shard_size:
+                    yield ''.join(lines), len(lines)
+                    lines = []
+            if lines:
+                yield ''.join(lines), len(lines)
+
+    return columns, shards()
+
+
+def chunks(items, size):
+    """
+    Split iterable into lists of specified size
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def is_path(source):
+    """
+    :return: True if source is a file path
+    """
+    return isinstance(source, (str, bytes, os.PathLike))
@@ -0,0 +1,160 @@
+import re
+import json
+import select
+import logging
+import threading
+import psycopg2
+
+_MAX_PAYLOAD_LENGTH = 7900
+_MAX_NOTIFIED_KEYS = 1000
+
+
+def check_channel_name(channel):
+    """
+    Raise exception if channel is not a valid PostgreSQL identifier
+    :param channel: notification channel name
+    """
+    if not isinstance(channel, str) or not re.fullmatch(r'[a-z_][a-z0-9_]*', channel):
+        raise Exception(f'Invalid notification channel: {channel}')
+
+
+def build_payloads(invalidations):
+    """
+    Coalesce pending invalidations into notification payloads.
+    Each table gets as few payloads as fit into the NOTIFY payload limit,
+    tables with too many changed keys are invalidated as a whole.
+    :param invalidations: dict of table name to set of keys or None for the whole table
+    :return: list of JSON payloads
+    """
+    payloads = []
+    for table_name, keys in invalidations.items():
+        if keys is None or len(keys) > _MAX_NOTIFIED_KEYS:
+            payloads.append(json.dumps({'table': table_name, 'keys': None}))
+            continue
+        chunk = []
+        chunk_length = 0
+        for key in keys:
+            key_length = len(json.dumps(key)) + 2
+            if chunk and chunk_length + key_length > _MAX_PAYLOAD_LENGTH:
+                payloads.append(json.dumps({'table': table_name, 'keys': chunk}))
+                chunk = []
+                chunk_length = 0
+            chunk.append(key)
+            chunk_length += key_length
+        if chunk:
+            payloads.append(json.dumps({'table': table_name, 'keys': chunk}))
+    return payloads
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Background thread listening to cache invalidation notifications.
+    It uses a separate connection and evicts notified rows from cache
+    """
+
+    _MAX_RECONNECT_DELAY = 30.0
+
+    def __init__(self, cache, channel, ignore_pid=None, poll_timeout=1.0, **config):
+        """
+        Construct listener
+        :param cache: ObjectCache to invalidate
+        :param channel: notification channel name
+        :param ignore_pid: backend pid which notifications are skipped (own writes)
+        :param poll_timeout: seconds to wait for notifications before checking for stop,
+        also the first reconnect delay after listener connection is lost
+        :param config: database connection config
+        """
+        super().__init__(name=f'py2sqlm-listener-{channel}', daemon=True)
+        check_channel_name(channel)
+        self.cache = cache
+        self.channel = channel
+        self.ignore_pid = ignore_pid
+        self.poll_timeout = poll_timeout
+        self._config = config
+        self._stopped = threading.Event()
+        self._connection = None
+
+    def start(self):
+        """
+        Connect, subscribe to channel and start listening
+        """
+        self._listen()
+        super().start()
+        logging.info(f'Listening to channel {self.channel}')
+
+    def stop(self):
+        """
+        Stop listening and close listener connection
+        """
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+        self._close_connection()
+        self._connection = None
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self._receive()
+            except (psycopg2.Error, OSError, ValueError) as exc:
+                logging.warning(f'Listener connection to channel {self.channel} is lost: {exc}')
+                self.cache.clear()
+                self._reconnect()
+
+    def _receive(self):
+        if select.select([self._connection], [], [], self.poll_timeout) == ([], [], []):
+            return
+        self._connection.poll()
+        invalidations = {}
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            if notify.pid == self.ignore_pid:
+                continue
+            self._collect(invalidations, notify.payload)
+        self._invalidate(invalidations)
+
+    def _listen(self):
+        self._connection = psycopg2.connect(**self._config)
+        self._connection.autocommit = True
+        with self._connection.cursor() as cursor:
+            cursor.execute(f'listen {self.channel}')
+
+    def _reconnect(self):
+        delay = self.poll_timeout
+        while not self._stopped.wait(delay):
+            self._close_connection()
+            try:
+                self._listen()
+            except psycopg2.Error as exc:
+                logging.warning(f'Listener reconnect to channel {self.channel} failed: {exc}')
+                delay = min(delay * 2, self._MAX_RECONNECT_DELAY)
+                continue
+            # notifications sent while disconnected are lost
+            self.cache.clear()
+            logging.info(f'Listening to channel {self.channel} again')
+            return
+
+    def _close_connection(self):
+        if self._connection is not None and not self._connection.closed:
+            self._connection.close()
+
+    @staticmethod
+    def _collect(invalidations, payload):
+        try:
+            message = json.loads(payload)
+            table_name, keys = message['table'], message['keys']
+        except (ValueError, KeyError, TypeError):
+            logging.warning(f'Invalid invalidation notification: {payload}')
+            return
+        if keys is None or invalidations.get(table_name, ()) is None:
+            invalidations[table_name] = None
+        else:
+            invalidations.setdefault(table_name, set()).update(keys)
+
+    def _invalidate(self, invalidations):
+        for table_name, keys in invalidations.items():
+            if keys is None:
+                self.cache.invalidate_table(table_name)
+                continue
+            for key in keys:
+                self.cache.invalidate(table_name, key)
@@ -0,0 +1,31 @@
+import json
+import base64
+from datetime import datetime
+
+
+def encode_cursor(table_name, values):
+    """
+    Encode position after the last row of page into opaque cursor
+    :param table_name: table name
+    :param values: order column values of the last row
+    :return: cursor string
+    """
+    values = [{'datetime': value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    data = json.dumps([table_name, values]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def decode_cursor(table_name, cursor):
+    """
+    Decode cursor produced by encode_cursor
+    :param table_name: expected table name
+    :param cursor: cursor string
+    :return: order column values of the last row
+    """
+    try:
+        cursor_table_name, values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, AttributeError):
+        raise Exception(f'Invalid cursor: {cursor}')
+    if cursor_table_name != table_name:
+        raise Exception(f'Cursor belongs to table {cursor_table_name}, not {table_name}')
+    return [datetime.fromisoformat(value['datetime']) if isinstance(value, dict) else value for value in values]
@@ -0,0 +1,218 @@
+import re
+from datetime import datetime, timedelta
+from py2sqlm.fields import *
+from py2sqlm.indexes import get_class_indexes
+
+_INTERVAL_PATTERN = re.compile(r'\s*(\d+)\s+(day|week|month|year)s?\s*')
+_PARTITION_NAME_PATTERN = re.compile(r'_p(\d{8})$')
+
+
+class RangePartitioning:
+    """
+    Range partitioning by DateTimeField.
+    Each partition covers one interval, e.g. '1 month' or '7 days'
+    """
+
+    method = 'range'
+
+    def __init__(self, field_name, ahead=3):
+        """
+        Construct range partitioning
+        :param field_name: partition key attribute name
+        :param ahead: number of upcoming partitions to create in advance
+        """
+        if not isinstance(ahead, int) or ahead < 0:
+            raise Exception(f'Invalid number of partitions ahead: {ahead}')
+        self.field_name = field_name
+        self.ahead = ahead
+        self.interval = None
+
+    @property
+    def interval(self):
+        """
+        Partition interval property
+        """
+        return self._interval
+
+    @interval.setter
+    def interval(self, value):
+        """
+        Set partition interval like '1 month'
+        """
+        if value is None:
+            self._interval = None
+            return
+        match = _INTERVAL_PATTERN.fullmatch(value) if isinstance(value, str) else None
+        if not match or int(match.group(1)) < 1:
+            raise Exception(f'Invalid partition interval: {value}')
+        self._interval = value
+        self._count = int(match.group(1))
+        self._unit = match.group(2)
+
+    def check(self, clz):
+        """
+        Raise exception if partitioning does not fit table class
+        """
+        if self.interval is None:
+            raise Exception(f'Range partitioning of {clz.__name__} requires interval')
+        if not isinstance(clz.__dict__.get(self.field_name), DateTimeField):
+            raise Exception(f'Range partition key {self.field_name} should be a DateTimeField')
+
+    def period_start(self, moment):
+        """
+        :param moment: datetime
+        :return: start of the partition period containing moment
+        """
+        if self._unit in ('day', 'week'):
+            epoch = datetime(1970, 1, 1) if self._unit == 'day' else datetime(1970, 1, 5)
+            step = timedelta(days=self._count * (7 if self._unit == 'week' else 1))
+            return epoch + (moment - epoch) // step * step
+        step = self._count * (12 if self._unit == 'year' else 1)
+        months = moment.year * 12 + moment.month - 1
+        months -= months % step
+        return datetime(months // 12, months % 12 + 1, 1)
+
+    def next_period_start(self, start):
+        """
+        :param start: partition period start
+        :return: start of the following partition period
+        """
+        if self._unit in ('day', 'week'):
+            return start + timedelta(days=self._count * (7 if self._unit == 'week' else 1))
+        months = start.year * 12 + start.month - 1 + self._count * (12 if self._unit == 'year' else 1)
+        return datetime(months // 12, months % 12 + 1, 1)
+
+    def last_period_start(self, moment, ahead):
+        """
+        :param moment: datetime
+        :param ahead: number of upcoming partitions
+        :return: start of the last partition period to create in advance
+        """
+        start = self.period_start(moment)
+        for _ in range(ahead):
+            start = self.next_period_start(start)
+        return start
+
+    @staticmethod
+    def partition_name(table_name, start):
+        """
+        :return: name of partition starting at start
+        """
+        return f'{table_name}_p{start:%Y%m%d}'
+
+    @staticmethod
+    def partition_start(partition_name):
+        """
+        :return: start of partition by its name or None if it is not a managed partition
+        """
+        match = _PARTITION_NAME_PATTERN.search(partition_name)
+        if not match:
+            return None
+        return datetime.strptime(match.group(1), '%Y%m%d')
+
+
+class HashPartitioning:
+    """
+    Hash partitioning into fixed number of partitions
+    """
+
+    method = 'hash'
+
+    def __init__(self, field_name=None, partitions=8):
+        """
+        Construct hash partitioning
+        :param field_name: partition key attribute name (default - primary key)
+        :param partitions: number of partitions
+        """
+        if not isinstance(partitions, int) or partitions < 1:
+            raise Exception(f'Invalid number of partitions: {partitions}')
+        self.field_name = field_name
+        self.partitions = partitions
+
+    def check(self, clz):
+        """
+        Raise exception if partitioning does not fit table class
+        """
+        if self.field_name is not None and not isinstance(clz.__dict__.get(self.field_name), DatabaseField):
+            raise Exception(f'Hash partition key {self.field_name} is not a database field of {clz.__name__}')
+
+    def partition_name(self, table_name, remainder):
+        """
+        :return: name of partition for hash remainder
+        """
+        return f'{table_name}_h{remainder}'
+
+
+def by_range(field_name, ahead=3):
+    """
+    Declare range partitioning, interval is specified in @table
+    :param field_name: DateTimeField attribute name
+    :param ahead: number of upcoming partitions to create in advance
+    :return: range partitioning
+    """
+    return RangePartitioning(field_name, ahead)
+
+
+def by_hash(field_name=None, partitions=8):
+    """
+    Declare hash partitioning
+    :param field_name: attribute name (default - primary key)
+    :param partitions: number of partitions
+    :return: hash partitioning
+    """
+    return HashPartitioning(field_name, partitions)
+
+
+def get_partition_key(clz):
+    """
+    Helper method to get partition key field of partitioned class
+    :param clz: table class
+    :return: partition key field or None if table is not partitioned
+    """
+    partitioning = getattr(clz, '_table_partitioning', None)
+    if partitioning is None:
+        return None
+    if partitioning.field_name is None:
+        return get_primary_key(clz)
+    return clz.__dict__[partitioning.field_name]
+
+
+def get_key_columns(clz):
+    """
+    Helper method to get table primary key columns.
+    Primary key of partitioned table includes partition key
+    :param clz: table class
+    :return: list of primary key column names
+    """
+    columns = [get_column_name(get_primary_key(clz))]
+    partition_key = get_partition_key(clz)
+    if partition_key is not None and get_column_name(partition_key) not in columns:
+        columns.append(get_column_name(partition_key))
+    return columns
+
+
+def check_partitioned_keys(clz):
+    """
+    Helper method to raise exception if unique index of partitioned class does not include partition key
+    or if class references partitioned table whose primary key includes partition key.
+    Such constraints can not be created in PostgreSQL
+    :param clz: table class
+    """
+    partition_key = get_partition_key(clz)
+    if partition_key is not None:
+        for index in get_class_indexes(clz):
+            if index.unique and get_column_name(partition_key) not in index.columns(clz):
+                raise Exception(f'Unique index {index.name(clz)} of partitioned {clz.__name__} '
+                                f'should include partition key {partition_key.name}')
+    for field in get_class_database_fields(clz):
+        if isinstance(field, ForeignKey) and len(get_key_columns(field.mapping_class)) > 1:
+            raise Exception(f'{clz.__name__}.{field.name} can not reference partitioned '
+                            f'{field.mapping_class.__name__}, its primary key includes partition key')
+    for relation in get_many_relations(clz):
+        if not relation.is_linked:
+            continue
+        linked_classes = [clz] if relation.back_reference else [clz, relation.mapping_class]
+        for linked_class in linked_classes:
+            if len(get_key_columns(linked_class)) > 1:
+                raise Exception(f'{clz.__name__}.{relation.name} can not link partitioned '
+                                f'{linked_class.__name__}, its primary key includes partition key')
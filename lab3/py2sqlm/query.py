@@ -0,0 +1,116 @@
+import re
+from functools import lru_cache
+from py2sqlm.fields import *
+from py2sqlm.conditions import *
+from py2sqlm.loader import to_sql_row
+
+_PLACEHOLDER_PATTERN = re.compile(r'%s')
+
+
+def compile_condition(clz, condition):
+    """
+    Compile condition to parameterized SQL.
+    SQL is compiled once per condition shape: structure, columns and operators without values
+    :param clz: table class of condition fields
+    :param condition: condition built from field descriptors
+    :return: tuple of SQL condition with %s placeholders and list of parameters
+    """
+    params = []
+    shape = get_shape(clz, condition, params)
+    return compile_shape(shape), params
+
+
+def get_shape(clz, condition, params):
+    """
+    Get hashable shape of condition and collect its parameters
+    :param clz: table class of condition fields
+    :param condition: condition
+    :param params: list to append parameters to
+    :return: condition shape
+    """
+    if isinstance(condition, Comparison):
+        column = _get_column(clz, condition.field)
+        if isinstance(condition.value, Comparable):
+            return 'field', column, condition.operator, _get_column(clz, condition.value)
+        if condition.value is None:
+            if condition.operator not in ('=', '<>'):
+                raise Exception('Null can be compared only for equality')
+            return 'null', column, condition.operator
+        params.append(_to_param(condition.field, condition.value))
+        return 'value', column, condition.operator
+    if isinstance(condition, In):
+        params.append([_to_param(condition.field, value) for value in condition.values])
+        return 'in', _get_column(clz, condition.field)
+    if isinstance(condition, (And, Or)):
+        operator = 'and' if isinstance(condition, And) else 'or'
+        return (operator,) + tuple([get_shape(clz, nested, params) for nested in condition.conditions])
+    if isinstance(condition, Not):
+        return 'not', get_shape(clz, condition.condition, params)
+    raise Exception(f'Invalid condition: {condition}')
+
+
+@lru_cache(maxsize=1024)
+def compile_shape(shape):
+    """
+    :param shape: condition shape
+    :return: SQL condition with %s placeholders
+    """
+    kind = shape[0]
+    if kind == 'value':
+        return f'{shape[1]} {shape[2]} %s'
+    if kind == 'field':
+        return f'{shape[1]} {shape[2]} {shape[3]}'
+    if kind == 'null':
+        return f"{shape[1]} is {'not ' if shape[2] == '<>' else ''}null"
+    if kind == 'in':
+        return f'{shape[1]} = any(%s)'
+    if kind == 'not':
+        return f'not ({compile_shape(shape[1])})'
+    return '(' + f' {kind} '.join([compile_shape(nested) for nested in shape[1:]]) + ')'
+
+
+@lru_cache(maxsize=1024)
+def compile_select(table_name, columns, shape, order_columns, limit):
+    """
+    :param table_name: table name
+    :param columns: tuple of selected columns
+    :param shape: condition shape or None
+    :param order_columns: tuple of order columns
+    :param limit: True if query has limit parameter
+    :return: select query with %s placeholders
+    """
+    return f"""
+            select {', '.join(columns)}
+            from {table_name}
+            {f'where {compile_shape(shape)}' if shape is not None else ''}
+            {f"order by {', '.join(order_columns)}" if order_columns else ''}
+            {'limit %s' if limit else ''}
+        """
+
+
+@lru_cache(maxsize=1024)
+def to_prepared_query(query):
+    """
+    :param query: query with %s placeholders
+    :return: tuple of query with $n placeholders and number of parameters
+    """
+    count = 0
+
+    def placeholder(match):
+        nonlocal count
+        count += 1
+        return f'${count}'
+
+    return _PLACEHOLDER_PATTERN.sub(placeholder, query), count
+
+
+def _get_column(clz, field):
+    if not isinstance(field, DatabaseField) or clz.__dict__.get(field.name) is not field:
+        raise Exception(f'{field} is not a database field of {clz.__name__}')
+    return get_column_name(field)
+
+
+def _to_param(field, value):
+    if isinstance(field, ForeignKey) and isinstance(value, field.mapping_class):
+        value = getattr(value, get_primary_key(field.mapping_class).name)
+    return to_sql_row([value])[0]
@@ -0,0 +1,98 @@
+import time
+import logging
+import psycopg2
+
+
+class ReplicaPool:
+    """
+    Read replica connections with round robin or least loaded selection.
+    Replicas are connected on first use, failed replicas are skipped for retry_after seconds
+    """
+
+    selections = {'round_robin', 'least_loaded'}
+
+    _LATENCY_SMOOTHING = 0.2
+
+    def __init__(self, replicas, selection='round_robin', retry_after=30.0):
+        """
+        Construct replica pool
+        :param replicas: list of replica connection configs (dicts) or DSN strings
+        :param selection: 'round_robin' or 'least_loaded' (lowest average query latency)
+        :param retry_after: seconds to skip failed replica
+        """
+        if not replicas:
+            raise Exception('At least one replica should be specified')
+        if selection not in self.selections:
+            raise Exception(f'Invalid replica selection: {selection}')
+        self.selection = selection
+        self.retry_after = retry_after
+        self._replicas = [_Replica(config) for config in replicas]
+        self._next = 0
+
+    def choose(self):
+        """
+        :return: replica connection or None if all replicas are unavailable
+        """
+        now = time.monotonic()
+        if self.selection == 'least_loaded':
+            replicas = sorted(self._replicas, key=lambda replica: replica.latency)
+        else:
+            replicas = self._replicas[self._next:] + self._replicas[:self._next]
+            self._next = (self._next + 1) % len(self._replicas)
+        for replica in [replica for replica in replicas if replica.failed_until <= now]:
+            try:
+                return replica.connect()
+            except psycopg2.OperationalError as exc:
+                logging.warning(f'Replica is unavailable: {exc}')
+                replica.fail(now + self.retry_after)
+        return None
+
+    def record(self, connection, seconds):
+        """
+        Record query latency of replica connection
+        """
+        replica = self._find(connection)
+        replica.latency += (seconds - replica.latency) * self._LATENCY_SMOOTHING
+
+    def fail(self, connection):
+        """
+        Close failed replica connection and skip the replica for retry_after seconds
+        """
+        self._find(connection).fail(time.monotonic() + self.retry_after)
+
+    def close(self):
+        """
+        Close all replica connections
+        """
+        for replica in self._replicas:
+            replica.close()
+
+    def _find(self, connection):
+        return next(replica for replica in self._replicas if replica.connection is connection)
+
+
+class _Replica:
+
+    def __init__(self, config):
+        self.config = config
+        self.connection = None
+        self.latency = 0.0
+        self.failed_until = 0.0
+
+    def connect(self):
+        if self.connection is None or self.connection.closed:
+            if isinstance(self.config, str):
+                self.connection = psycopg2.connect(self.config)
+            else:
+                self.connection = psycopg2.connect(**self.config)
+            self.connection.set_session(readonly=True, autocommit=True)
+        return self.connection
+
+    def fail(self, until):
+        self.close()
+        self.failed_until = until
+
+    def close(self):
+        if self.connection is not None and not self.connection.closed:
+            self.connection.close()
+        self.connection = None
@@ -0,0 +1,46 @@
+from collections import namedtuple
+
+TableStats = namedtuple('TableStats', [
+    'heap_bytes',
+    'toast_bytes',
+    'index_bytes',
+    'total_bytes',
+    'estimated_rows',
+    'dead_rows',
+    'last_vacuum',
+    'last_analyze'
+])
+TableStats.__doc__ = """
+Table statistics snapshot.
+Sizes are exact numbers of bytes, row counts are planner estimates.
+Partitioned tables are summarized over all their partitions
+"""
+
+TABLE_STATS_QUERY = """
+    with tables as (
+        select c.oid, c.relname
+        from pg_catalog.pg_class c
+        join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+        where n.nspname = 'public' and c.relkind in ('r', 'p') and not c.relispartition
+        and (%(names)s::text[] is null or c.relname = any(%(names)s))
+    ), relations as (
+        select relname, oid as relid from tables
+        union all
+        select t.relname, p.relid
+        from tables t, pg_partition_tree(t.oid) p
+        where p.isleaf and p.relid <> t.oid
+    )
+    select r.relname,
+        sum(pg_relation_size(r.relid))::bigint,
+        sum(coalesce(pg_total_relation_size(nullif(c.reltoastrelid, 0)), 0))::bigint,
+        sum(pg_indexes_size(r.relid))::bigint,
+        sum(pg_total_relation_size(r.relid))::bigint,
+        sum(greatest(c.reltuples, 0))::bigint,
+        sum(coalesce(s.n_dead_tup, 0))::bigint,
+        max(greatest(s.last_vacuum, s.last_autovacuum)),
+        max(greatest(s.last_analyze, s.last_autoanalyze))
+    from relations r
+    join pg_catalog.pg_class c on c.oid = r.relid
+    left join pg_catalog.pg_stat_user_tables s on s.relid = r.relid
+    group by r.relname
+"""
@@ -1,23 +1,66 @@
 import inspect
-from functools import wraps
+import hashlib
 from py2sqlm.utils import camel_case_to_snake_case
+from py2sqlm.fields import get_class_database_fields, get_many_relations, register_linked_relations
+from py2sqlm.indexes import get_class_indexes
+from py2sqlm.partitions import RangePartitioning, check_partitioned_keys
 
+SCHEMA_COMMENT_PREFIX = 'py2sqlm schema '
 
-def table(param):
+
+def table(param=None, indexes=None, partition_by=None, interval=None):
     """
     Decorator for tables.
     If table name is not specified it is a class name converted to snake case.
     :param param: either table name or class to decorate
+    :param indexes: list of composite Index declarations
+    :param partition_by: partitioning declared with by_range or by_hash
+    :param interval: range partition interval like '1 month'
     :return: either table wrapper or table class
     """
     if inspect.isclass(param):
-        table_name = camel_case_to_snake_case(param.__name__)
-        setattr(param, '_table_name', table_name)
-        return param
+        return _decorate(param, None, indexes, partition_by, interval)
 
-    @wraps(param)
     def wrapper(clz):
-        setattr(clz, '_table_name', param)
-        return clz
+        return _decorate(clz, param, indexes, partition_by, interval)
 
     return wrapper
+
+
+def _decorate(clz, table_name, indexes, partitioning, interval):
+    if table_name is None:
+        table_name = camel_case_to_snake_case(clz.__name__)
+    if interval is not None:
+        if not isinstance(partitioning, RangePartitioning):
+            raise Exception('Interval can be specified only for range partitioning')
+        partitioning.interval = interval
+    if partitioning is not None:
+        partitioning.check(clz)
+    setattr(clz, '_table_name', table_name)
+    setattr(clz, '_table_indexes', list(indexes or []))
+    setattr(clz, '_table_partitioning', partitioning)
+    check_partitioned_keys(clz)
+    setattr(clz, '_table_fingerprint', get_fingerprint(clz))
+    register_linked_relations(clz)
+    return clz
+
+
+def get_fingerprint(clz):
+    """
+    Compute stable fingerprint of table schema:
+    column definitions, indexes, partitioning and stored many relation links
+    :param clz: table class
+    :return: hex digest
+    """
+    parts = [clz._table_name]
+    parts += sorted([field.definition for field in get_class_database_fields(clz)])
+    parts += sorted([' '.join(index.create_query(clz).split()) for index in get_class_indexes(clz)])
+    partitioning = clz._table_partitioning
+    if partitioning is not None:
+        parts.append(f'partition by {partitioning.method} {partitioning.field_name} '
+                     f'{getattr(partitioning, "interval", None)} {getattr(partitioning, "partitions", None)}')
+    for relation in get_many_relations(clz):
+        if relation.is_linked:
+            parts.append(f'{relation.name} {relation.mapping_class._table_name} '
+                         f'{relation.back_reference} {relation.join_table}')
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()[:32]
@@ -1,9 +1,18 @@
+import copy
+import time
+import pickle
 import logging
+from datetime import datetime, timedelta
+import numpy
 import utils as test_utils
 
 from py2sqlm import Py2SQL
+from py2sqlm.cache import ObjectCache
+from py2sqlm.columns import BinaryCopyReader
 from py2sqlm.fields import *
 from py2sqlm.table import table
+from py2sqlm.indexes import Index
+from py2sqlm.partitions import by_range, by_hash
 
 logging.basicConfig(level='INFO')
 
@@ -12,7 +21,7 @@ logging.basicConfig(level='INFO')
 class GeoInfo:
     id = IntField(primary_key=True)
     area = FloatField()
-    tags = JsonbField()
+    tags = JsonbField(gin_path_ops=True, deferred=True)
 
     def __init__(self, id, area, tags):
         self.id = id
@@ -24,22 +33,20 @@ class GeoInfo:
 class Person:
     id = IntField(primary_key=True)
     name = TextField()
-    city_id = IntField()
 
-    def __init__(self, id, name, city_id):
+    def __init__(self, id, name):
         self.id = id
         self.name = name
-        self.city_id = city_id
 
 
-@table
+@table(indexes=[Index('name', 'capital')])
 class City:
     id = IntField(primary_key=True)
     name = TextField(100)
     capital = BoolField()
     geo_info = ForeignKey(GeoInfo)
     geo_info_new = ForeignKey(GeoInfo, mapping_column='geo_info_new_id')
-    citizens = ManyRelation(Person)
+    citizens = ManyRelation(Person, back_reference=True)
 
     def __init__(self, id, name, capital, geo_info, geo_info_new, citizens):
         self.id = id
@@ -50,6 +57,72 @@ class City:
         self.citizens = citizens
 
 
+@table
+class Author:
+    id = IntField(primary_key=True)
+    name = TextField()
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+@table
+class Book:
+    id = IntField(primary_key=True)
+    title = TextField()
+
+    def __init__(self, id, title):
+        self.id = id
+        self.title = title
+
+
+@table
+class Library:
+    id = IntField(primary_key=True)
+    name = TextField()
+    books = ManyRelation(Book, back_reference=True)
+    authors = ManyRelation(Author, join_table=True)
+
+    def __init__(self, id, name, books, authors):
+        self.id = id
+        self.name = name
+        self.books = books
+        self.authors = authors
+
+
+@table(partition_by=by_range('created_at', ahead=2), interval='1 month')
+class Event:
+    id = IntField(primary_key=True)
+    created_at = DateTimeField()
+    payload = JsonbField()
+
+    def __init__(self, id, created_at, payload):
+        self.id = id
+        self.created_at = created_at
+        self.payload = payload
+
+
+@table(partition_by=by_hash(partitions=4))
+class Visit:
+    id = IntField(primary_key=True)
+    url = TextField()
+
+    def __init__(self, id, url):
+        self.id = id
+        self.url = url
+
+
+@table(indexes=[Index('name', unique=True)])
+class Tag:
+    id = IntField(primary_key=True)
+    name = TextField()
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
 if __name__ == '__main__':
     db_config = {
         'host': 'localhost',
@@ -60,7 +133,7 @@ if __name__ == '__main__':
     }
     test_utils.drop_all_tables(db_config)
 
-    py2sql = Py2SQL()
+    py2sql = Py2SQL(cache=ObjectCache(max_size=100, ttl=60), notify_channel='py2sqlm_test')
     py2sql.db_connect(**db_config)
 
     db_engine = py2sql.db_engine
@@ -84,6 +157,7 @@ if __name__ == '__main__':
     db_table_structure = py2sql.db_table_structure('geo_info')
     logging.info(f'Table geo_info structure: {db_table_structure}')
     assert test_utils.table_structure_matches({('id', 'bigint'), ('area', 'real'), ('tags', 'jsonb')}, db_table_structure)
+    assert test_utils.get_table_indexes(db_config, 'geo_info') == ['geo_info_pkey', 'geo_info_tags_gin_path']
 
     test_utils.execute(db_config, """
       alter table geo_info
@@ -103,6 +177,7 @@ if __name__ == '__main__':
     db_table_structure = py2sql.db_table_structure('geo_info')
     logging.info(f'Table geo_info structure: {db_table_structure}')
     assert test_utils.table_structure_matches({('id', 'bigint'), ('area', 'real'), ('tags', 'jsonb')}, db_table_structure)
+    assert test_utils.get_table_indexes(db_config, 'geo_info') == ['geo_info_pkey', 'geo_info_tags_gin_path']
 
     geo_info = GeoInfo(5, None, {'density': 75, 'high': True})
     py2sql.save_object(geo_info)
@@ -131,7 +206,7 @@ if __name__ == '__main__':
 
     db_tables = py2sql.db_tables
     logging.info(f'Database tables: {db_tables}')
-    assert db_tables == ['city', 'geo_info']
+    assert db_tables == ['city', 'geo_info', 'person']
 
     db_table_structure = py2sql.db_table_structure('city')
     logging.info(f'Table city structure: {db_table_structure}')
@@ -142,10 +217,40 @@ if __name__ == '__main__':
     logging.info(f'Table geo_info structure: {db_table_structure}')
     assert test_utils.table_structure_matches({('id', 'bigint'), ('area', 'real'), ('tags', 'jsonb')}, db_table_structure)
 
+    assert test_utils.get_table_indexes(db_config, 'city') == ['city_name_capital_idx', 'city_pkey']
+    test_utils.execute(db_config, 'drop index city_name_capital_idx')
+    py2sql.save_hierarchy(City)
+    assert test_utils.get_table_indexes(db_config, 'city') == ['city_pkey']
+    py2sql.save_class(City)
+    assert test_utils.get_table_indexes(db_config, 'city') == ['city_name_capital_idx', 'city_pkey']
+    test_utils.execute(db_config, "update pg_index set indisvalid = false where indexrelid = 'city_name_capital_idx'::regclass")
+    test_utils.execute(db_config, 'comment on index city_name_capital_idx is null')
+    py2sql.save_class(City)
+    assert test_utils.select_all(db_config, """
+        select i.indisvalid, obj_description(i.indexrelid, 'pg_class') from pg_index i
+        where i.indexrelid = 'city_name_capital_idx'::regclass
+    """) == [(True, 'py2sqlm')]
+
+    py2sql.save_class(Tag)
+    test_utils.execute(db_config, 'drop index tag_name_key')
+    test_utils.execute(db_config, "insert into tag values (1, 'a'), (2, 'a')")
+    try:
+        py2sql.save_class(Tag)
+        assert False
+    except Exception as exc:
+        assert 'tag_name_key' in str(exc)
+    assert test_utils.select_all(db_config, "select obj_description('tag'::regclass, 'pg_class')") == [(None,)]
+    test_utils.execute(db_config, 'delete from tag where id = 2')
+    py2sql.save_hierarchy(Tag)
+    assert test_utils.get_table_indexes(db_config, 'tag') == ['tag_name_key', 'tag_pkey']
+    assert test_utils.select_all(db_config, "select obj_description('tag'::regclass, 'pg_class')")[0][0] is not None
+    py2sql.delete_class(Tag)
+
     py2sql.save_class(Person)
+    assert test_utils.get_table_indexes(db_config, 'person') == ['person_city_id_link_idx', 'person_pkey']
 
     geo_info = GeoInfo(5, 32, {'density': 75, 'high': True})
-    citizens = [Person(1, 'adam', 123), Person(2, 'craig', 24)]
+    citizens = [Person(1, 'adam'), Person(2, 'craig')]
     city = City(123, 'Florence', False, geo_info, None, citizens)
     py2sql.save_object(city)
 
@@ -175,7 +280,7 @@ if __name__ == '__main__':
     assert person_select[0][2] == 123
     assert person_select[1][0] == 2
     assert person_select[1][1] == 'craig'
-    assert person_select[1][2] == 24
+    assert person_select[1][2] == 123
 
     city.capital = True
     geo_info.area = 34
@@ -197,6 +302,75 @@ if __name__ == '__main__':
     assert len(person_select) == 2
     assert person_select[0][1] == 'bob'
 
+    loaded_city = py2sql.load_object(City, 123)
+    logging.info(f'Cache stats: {py2sql.cache_stats}')
+    assert loaded_city.name == 'Florence'
+    assert loaded_city.capital == True
+    assert loaded_city.geo_info.area == 34.0
+    assert loaded_city.geo_info.tags == {'density': 75, 'high': True}
+    assert loaded_city.geo_info_new == None
+    assert py2sql.load_object(City, 123) is loaded_city
+    assert py2sql.cache_stats['hits'] == 1
+    assert py2sql.load_object(City, 321) == None
+    assert test_utils.can_lock_table(db_config, 'city')
+    generation = py2sql.cache.generation('city')
+    py2sql.cache.invalidate('city', 123)
+    py2sql.cache.put(loaded_city, generation)
+    assert py2sql.load_object(City, 123) is not loaded_city
+    assert py2sql.load_object(City, 123) is py2sql.load_object(City, 123)
+
+    city.name = 'Firenze'
+    py2sql.save_object(city)
+    assert py2sql.load_object(City, 123).name == 'Firenze'
+    persons = py2sql.load_objects(Person)
+    assert sorted([person.name for person in persons]) == ['bob', 'craig']
+    projected_cities = py2sql.load_objects(City, only=['name'])
+    assert not City.capital.is_loaded(projected_cities[0])
+    assert not City.citizens.is_loaded(projected_cities[0])
+    assert projected_cities[0].geo_info.area == 34.0
+    py2sql.save_object(projected_cities[0])
+    py2sql.load_deferred(projected_cities)
+    assert projected_cities[0].capital == True and projected_cities[0].geo_info_new == None
+    assert [person.id for person in projected_cities[0].citizens] == [1, 2]
+    assert copy.deepcopy(loaded_city).geo_info.tags == {'density': 75, 'high': True}
+    assert pickle.loads(pickle.dumps(persons[0])).name == persons[0].name
+    test_utils.execute(db_config, "insert into city (id, name, capital) values (3, 'Pisa', false)")
+    deleted_city = py2sql.load_object(City, 3, only=['name'])
+    test_utils.execute(db_config, 'delete from city where id = 3')
+    try:
+        deleted_city.capital
+        assert False
+    except Exception as exc:
+        assert 'Failed to load capital of City 3' in str(exc)
+
+    other_py2sql = Py2SQL(cache=ObjectCache(), notify_channel='py2sqlm_test')
+    other_py2sql.db_connect(**db_config)
+    assert other_py2sql.load_object(City, 123).name == 'Firenze'
+    city.name = 'Florence'
+    py2sql.save_object(city)
+    for _ in range(50):
+        if len(other_py2sql.cache) == 0:
+            break
+        time.sleep(0.1)
+    logging.info(f'Other cache stats: {other_py2sql.cache_stats}')
+    assert other_py2sql.load_object(City, 123).name == 'Florence'
+    listener_pid = other_py2sql._listener._connection.get_backend_pid()
+    test_utils.execute(db_config, f'select pg_terminate_backend({listener_pid})')
+    for _ in range(50):
+        listener_connection = other_py2sql._listener._connection
+        if not listener_connection.closed and listener_connection.get_backend_pid() != listener_pid:
+            break
+        time.sleep(0.1)
+    assert other_py2sql._listener.is_alive()
+    other_py2sql.load_object(City, 123)
+    py2sql.save_object(city)
+    for _ in range(50):
+        if len(other_py2sql.cache) == 0:
+            break
+        time.sleep(0.1)
+    assert len(other_py2sql.cache) == 0
+    other_py2sql.db_disconnect()
+
     db_size = py2sql.db_size
     logging.info(f'Database size: {py2sql.db_size} Mb')
     assert db_size > 0
@@ -205,11 +379,175 @@ if __name__ == '__main__':
     logging.info(f'Geo info table size: {geo_info_table_size} Mb')
     assert geo_info_table_size > 0
 
+    replica_py2sql = Py2SQL(cache=ObjectCache())
+    bad_replica_config = dict(db_config, port=5433, connect_timeout=1)
+    replica_py2sql.db_connect(replicas=[db_config, bad_replica_config], sticky_seconds=0, **db_config)
+    for _ in range(3):
+        assert replica_py2sql.db_tables == py2sql.db_tables
+        assert replica_py2sql.load_object(City, 123).name == 'Florence'
+        assert replica_py2sql.load_columns(City, ['id'])['id'].tolist() == [123]
+    assert len(replica_py2sql.cache) == 0
+    replica_py2sql.db_disconnect()
+
+    table_stats = py2sql.table_stats()
+    logging.info(f'Table stats: {table_stats}')
+    assert set(table_stats) == {'city', 'geo_info', 'person'}
+    assert table_stats['geo_info'].total_bytes == geo_info_table_size * 1024 * 1024
+    assert table_stats['geo_info'].index_bytes > 0
+    assert list(py2sql.table_stats(City)) == ['city']
+
+    loaded_citizens = py2sql.parallel_load(Person, [Person(id, f'citizen {id}') for id in range(100, 1100)],
+                                           workers=2, shard_size=300)
+    assert loaded_citizens == 1000
+    new_geo_info = GeoInfo(6, 15, ['river'])
+    loaded_cities = py2sql.parallel_load(City, [City(id, f'city {id}', False, geo_info, new_geo_info, [])
+                                                for id in range(200, 210)], workers=2, method='insert')
+    assert loaded_cities == 10
+    assert len(test_utils.get_table_records(db_config, 'person', ['id'])) == 1002
+    assert len(test_utils.get_table_records(db_config, 'geo_info', ['id'])) == 2
+    synced_persons = [Person(id, f'citizen {id}') for id in range(100, 1050)] + \
+                     [Person(id, 'newcomer') for id in range(1100, 1200)] + \
+                     [Person(1, 'bob'), Person(2, 'craig')]
+    synced_persons[0].name = 'mayor'
+    assert py2sql.sync_objects(Person, synced_persons) == {'inserted': 100, 'updated': 1, 'deleted': 50}
+    assert py2sql.sync_objects(Person, synced_persons, unlogged=True) == {'inserted': 0, 'updated': 0, 'deleted': 0}
+    assert py2sql.delete_where(Person, 'id >= %s', (1050,)) == 100
+    py2sql.save_object(Person(100, 'citizen 100'))
+    py2sql.parallel_load(Person, [Person(id, f'citizen {id}') for id in range(1050, 1100)])
+
+    pages = list(py2sql.iter_pages(Person, page_size=300))
+    assert [len(page[0]) for page in pages] == [300, 300, 300, 102]
+    resumed_pages = list(py2sql.iter_pages(Person, page_size=300, after=pages[1][1]))
+    assert [person.id for person in resumed_pages[0][0]] == [person.id for person in pages[2][0]]
+    city_pages = list(py2sql.iter_pages(City, page_size=4, order_by=['name', 'capital'], only=['name']))
+    assert [len(page[0]) for page in city_pages] == [4, 4, 3]
+    assert len(set([city.id for page in city_pages for city in page[0]])) == 11
+
+    city_aggregates = py2sql.aggregate(City, count=True, group_by=City.geo_info_new, as_dict=True)
+    assert city_aggregates == [{'geo_info_new': 6, 'count': 10}, {'geo_info_new': None, 'count': 1}]
+    assert py2sql.aggregate(GeoInfo, count=True, sum=GeoInfo.area, max=['area', 'id']) == [(2, 49.0, 34.0, 6)]
+    assert py2sql.aggregate(Person, count='name', where='city_id = %s', params=(123,), as_dict=True) == \
+        [{'count_name': 2}]
+
+    person_columns = py2sql.load_columns(Person, [Person.id], where='id < %s', params=(1000,))
+    assert len(person_columns['id']) == 902
+    assert person_columns['id'].sum() == sum(range(100, 1000)) + 1 + 2
+    geo_info_columns = py2sql.load_columns(GeoInfo, ['area', 'id'])
+    assert sorted(geo_info_columns['area'].tolist()) == [15.0, 34.0]
+    assert test_utils.can_lock_table(db_config, 'geo_info')
+    city_columns = py2sql.load_columns(City, ['capital', 'geo_info'], chunk_size=4)
+    assert city_columns['capital'].sum() == 1 and set(city_columns['geo_info']) == {5}
+    py2sql.save_object(GeoInfo(7, None, {}))
+    assert numpy.isnan(py2sql.load_columns(GeoInfo, ['area'], where=GeoInfo.id == 7)['area']).all()
+    py2sql.delete_object(GeoInfo(7, None, {}))
+    copy_data = test_utils.copy_binary(db_config, '''
+        select i::bigint, case when i % 7 = 0 then null else i end::real from generate_series(1, 10000) i
+    ''')
+    copy_reader = BinaryCopyReader([GeoInfo.id, GeoInfo.area], chunk_size=100)
+    for i in range(0, len(copy_data), 1000):
+        copy_reader.write(copy_data[i:i + 1000])
+    copy_columns = copy_reader.result()
+    assert copy_columns['id'].tolist() == list(range(1, 10001))
+    assert numpy.isnan(copy_columns['area']).sum() == 10000 // 7
+    assert numpy.nansum(copy_columns['area']) == sum(i for i in range(1, 10001) if i % 7)
+
+    selected_cities = py2sql.select(City, where=(City.id >= 200) & City.id.in_([201, 203, 250]) | (City.capital == True),
+                                    order_by='id')
+    assert [city.id for city in selected_cities] == [123, 201, 203]
+    for _ in range(2):
+        prepared_cities = py2sql.select(City, where=(City.geo_info_new == new_geo_info) & ~(City.id < 205),
+                                        order_by=[City.name], limit=3, only=['name'], prepare=True)
+        assert [city.name for city in prepared_cities] == ['city 205', 'city 206', 'city 207']
+    assert py2sql.aggregate(City, count=True, where=City.geo_info_new == None) == [(1,)]
+    assert len(py2sql.load_columns(Person, ['id'], where=Person.name.in_(['bob', 'craig']))['id']) == 2
+    assert sum(len(page[0]) for page in py2sql.iter_pages(City, page_size=3, where=City.id >= 200)) == 10
+    assert py2sql.delete_where(City, City.id >= 200) == 10
+    assert py2sql.delete_objects([Person(id, '') for id in range(100, 1100)]) == 1000
+    assert len(test_utils.get_table_records(db_config, 'person', ['id'])) == 2
+    siena = City(300, 'Siena', False, geo_info, None, [Person(300, 'dante'), Person(301, 'cino')])
+    py2sql.save_object(siena)
+    assert py2sql.delete_objects([siena], cascade=True) == 3
+    assert len(test_utils.get_table_records(db_config, 'person', ['id'])) == 2
+
+    py2sql.save_hierarchy(Library)
+    assert {'author', 'book', 'library', 'library_authors'} <= set(py2sql.db_tables)
+
+    class Draft:
+        id = IntField(primary_key=True)
+        books = ManyRelation(Book, back_reference='draft_id')
+
+    assert get_mapped_relations(Book) == [Library.books]
+    try:
+        table(type('Shelf', (), {'id': IntField(primary_key=True), 'books': ManyRelation(Book, back_reference='id')}))
+        assert False
+    except Exception as exc:
+        assert 'Back reference id of Shelf.books collides with column of Book' in str(exc)
+    assert get_mapped_relations(Book) == [Library.books]
+    homer = Author(1, 'homer')
+    library = Library(1, 'central', [Book(1, 'odyssey'), Book(2, 'iliad')], [homer, Author(2, 'virgil')])
+    py2sql.save_object(library)
+    assert test_utils.get_table_records(db_config, 'book', ['id', 'library_id']) == [(1, 1), (2, 1)]
+    library.books = [library.books[1], Book(3, 'aeneid')]
+    library.authors = [homer]
+    py2sql.save_object(library)
+    assert test_utils.get_table_records(db_config, 'book', ['id', 'library_id']) == [(1, None), (2, 1), (3, 1)]
+    assert test_utils.get_table_records(db_config, 'library_authors', ['author_id']) == [(1,)]
+    py2sql.cache.clear()
+    loaded_library = py2sql.load_object(Library, 1)
+    assert not Library.books.is_loaded(loaded_library)
+    assert [book.id for book in loaded_library.books] == [2, 3]
+    py2sql.load_deferred([loaded_library])
+    assert [author.name for author in loaded_library.authors] == ['homer']
+    assert py2sql.delete_objects([loaded_library], cascade=True) == 3
+    assert test_utils.get_table_records(db_config, 'book', ['id', 'library_id']) == [(1, None)]
+    assert test_utils.get_table_records(db_config, 'library_authors', ['author_id']) == []
+    py2sql.delete_hierarchy(Library)
+
+    py2sql.save_class(Event)
+    event_partitions = test_utils.get_table_partitions(db_config, 'event')
+    logging.info(f'Event partitions: {event_partitions}')
+    assert len(event_partitions) == 3
+    event_partitioning = Event._table_partitioning
+    current_period_start = event_partitioning.period_start(datetime.now())
+    previous_period_start = event_partitioning.period_start(current_period_start - timedelta(seconds=1))
+    first_period_start = event_partitioning.period_start(previous_period_start - timedelta(seconds=1))
+    created_partitions = py2sql.create_partitions(Event, start=first_period_start)
+    assert len(created_partitions) == 2
+    py2sql.save_object(Event(1, datetime.now(), {'type': 'login'}))
+    py2sql.save_object(Event(2, first_period_start, {'type': 'logout'}))
+    dropped_partitions = py2sql.drop_partitions(Event, older_than=previous_period_start)
+    logging.info(f'Dropped event partitions: {dropped_partitions}')
+    assert dropped_partitions == sorted(created_partitions)[:1]
+    assert [event[0] for event in test_utils.get_table_records(db_config, 'event', ['id'])] == [1]
+    try:
+        py2sql.save_object(Event(3, datetime(2000, 1, 1), {'type': 'archived'}))
+        assert False
+    except Exception as exc:
+        assert 'Failed to save Event 3' in str(exc)
+    assert [event[0] for event in test_utils.get_table_records(db_config, 'event', ['id'])] == [1]
+    assert py2sql.table_stats(Event)['event'].heap_bytes > 0
+    py2sql.delete_class(Event)
+
+    py2sql.save_class(Visit)
+    assert len(test_utils.get_table_partitions(db_config, 'visit')) == 4
+    py2sql.delete_class(Visit)
+    try:
+        table(partition_by=by_hash())(type('Page', (), {'id': IntField(primary_key=True), 'url': TextField(unique=True)}))
+        assert False
+    except Exception as exc:
+        assert 'Unique index page_url_key of partitioned Page should include partition key id' in str(exc)
+    try:
+        table(type('Attendee', (), {'id': IntField(primary_key=True), 'event': ForeignKey(Event)}))
+        assert False
+    except Exception as exc:
+        assert 'Attendee.event can not reference partitioned Event' in str(exc)
+    table(type('Click', (), {'id': IntField(primary_key=True), 'visit': ForeignKey(Visit)}))
+
     py2sql.delete_hierarchy(City)
 
     db_tables = py2sql.db_tables
     logging.info(f'Database tables: {db_tables}')
-    assert db_tables == ['person']
+    assert db_tables == []
 
     py2sql.db_disconnect()
 
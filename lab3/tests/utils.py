@@ -1,3 +1,4 @@
+import io
 import psycopg2
 import logging
 
@@ -25,6 +26,28 @@ def select_all(db_config, query):
     return values
 
 
+def can_lock_table(db_config, table_name):
+    connection = _get_connection(db_config)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'lock table {table_name} in access exclusive mode nowait')
+        return True
+    except psycopg2.errors.LockNotAvailable:
+        return False
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def copy_binary(db_config, query):
+    output = io.BytesIO()
+    connection = _get_connection(db_config)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'copy ({query}) to stdout with (format binary)', output)
+    connection.close()
+    return output.getvalue()
+
+
 def get_table_records(db_config, table_name, fields):
     query = f"""
         select {', '.join([field for field in fields])} from {table_name}
@@ -35,6 +58,25 @@ def get_table_records(db_config, table_name, fields):
     return select_all(db_config, query)
 
 
+def get_table_indexes(db_config, table_name):
+    query = f"""
+        select indexname from pg_indexes
+        where schemaname = 'public' and tablename = '{table_name}'
+        order by indexname
+    """
+    return [index[0] for index in select_all(db_config, query)]
+
+
+def get_table_partitions(db_config, table_name):
+    query = f"""
+        select c.relname from pg_inherits i
+        join pg_class c on c.oid = i.inhrelid
+        where i.inhparent = '{table_name}'::regclass
+        order by c.relname
+    """
+    return [partition[0] for partition in select_all(db_config, query)]
+
+
 def drop_all_tables(db_config):
     query = """
         drop schema public cascade;